@@ -0,0 +1,40 @@
+""" This file configures gunicorn to serve the dashboard in production:
+
+        gunicorn wsgi:server
+
+    The app and its data are loaded once in the master process (preload_app)
+    and shared with the forked workers. Each worker serves requests from a
+    pool of threads. The master also watches the data folder: when a
+    workbook changes it reloads the data once and replaces the workers with
+    new ones forked from it (see watcher.py), so they go on sharing one copy.
+    Settings are read from the environment:
+
+        ENERGY_BIND      address to listen on (default 0.0.0.0:8050)
+        ENERGY_WORKERS   worker processes (default one per CPU)
+        ENERGY_THREADS   threads per worker (default 4)
+        ENERGY_TIMEOUT   seconds before a silent worker is restarted
+                         (default 120) """
+
+import os
+
+bind = os.environ.get('ENERGY_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('ENERGY_WORKERS', '0')) or os.cpu_count() or 1
+threads = int(os.environ.get('ENERGY_THREADS', '4'))
+worker_class = 'gthread'
+timeout = int(os.environ.get('ENERGY_TIMEOUT', '120'))
+preload_app = True
+
+# The master watches the data folder once the workers are running. A change
+# is not reloaded in the watcher's thread but sent to the master as SIGHUP
+def when_ready(server):
+    from src.store import store
+    from src.watcher import DataWatcher, requestReload
+    DataWatcher(store, reload=requestReload).start()
+
+# On SIGHUP gunicorn runs this in the master's main thread, then forks new
+# workers and stops the old ones, which serve the old data until they exit
+def on_reload(server):
+    import wsgi
+    from src.store import store
+    from src.watcher import reloadRequested
+    reloadRequested(store, wsgi.preload)
@@ -1,12 +1,34 @@
+import logging
+import os
 from dash import Dash
 from dash_bootstrap_components.themes import BOOTSTRAP
 from src.components.layout.layout import create_layout
+from src.export import registerExport
+from src.metrics import registerMetrics
+from src.store import store
+from src.watcher import DataWatcher
 
-def main() -> None:
-    """ Main method """
+def create_app() -> Dash:
+    """ Create the dashboard. Nothing is loaded until the data is first used
+    or store.warm() is called """
     app = Dash(external_stylesheets=[BOOTSTRAP])
     app.title = "Cook County Energy Data and Projections"
     app.layout = create_layout(app)
+    registerMetrics(app.server)
+    registerExport(app.server)
+    logging.basicConfig(level=logging.INFO)
+    return app
+
+def main() -> None:
+    """ Main method, runs the development server. See wsgi.py and
+    gunicorn.conf.py for serving in production """
+    app = create_app()
+    # Load the data while the server starts, and pick up changed workbooks
+    # while it runs. In debug mode the reloader runs this file twice, and only
+    # the child process (WERKZEUG_RUN_MAIN) serves
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        store.warm(background=True)
+        DataWatcher(store).start()
     app.run_server(debug=True)
 
 if __name__ == "__main__":
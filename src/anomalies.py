@@ -0,0 +1,176 @@
+""" This file finds months where an office's or property's bills look wrong:
+    spikes or drops in usage or spending, and changes in what it pays per
+    kWh or therm (Total_Amount / kWh or therms), which often point to a
+    billing error. For a grouping it puts the usage and spending matrices of
+    both commodities into one array of commodities x series x entities x
+    months, with a column for every month between the first and the last,
+    and in one pass over it computes
+
+        month-over-month and year-over-year changes (relative to the earlier
+        month)
+        a rolling z-score: how many standard deviations a month is from the
+        mean of the WINDOW_MONTHS months before it, from running sums, so
+        the cost does not grow with the window
+
+    for usage, spending, and cost per unit. A month is flagged when any of
+    its z-scores is at least Z_THRESHOLD from 0, and its score is the
+    largest of them. The scan is kept per snapshot of the data, so the
+    anomalies tab only picks the top flagged rows out of it. """
+
+import numpy as np
+import pandas as pd
+from src.facts import COMMODITY_UNITS, PERIOD_LABEL_FORMAT, readOnly
+from src.metrics import timedStage
+
+# Series scanned for each commodity, in the order of the scan's layers
+SERIES = ('usage', 'spending', 'unit cost')
+
+# Months of history a month is compared against
+WINDOW_MONTHS = 12
+
+# Months of history needed before a month gets a z-score: a full window, so
+# every season is in it and a seasonal peak is not flagged for itself
+MIN_HISTORY = WINDOW_MONTHS
+
+# Distance from 0, in standard deviations, at which a month is flagged
+Z_THRESHOLD = 3.0
+
+# Standard deviations are taken to be at least this fraction of the mean, so
+# a small change to a very steady series is not flagged
+STD_FLOOR = 0.05
+
+# This function returns each month's value from the given number of months
+# earlier, NaN where that is before the first month
+def lagged(values, months):
+    earlier = np.full(values.shape, np.nan)
+    if months < values.shape[-1]:
+        earlier[..., months:] = values[..., :values.shape[-1] - months]
+    return earlier
+
+# This function returns the change of each month from the given number of
+# months earlier, relative to the earlier month. It is NaN where either
+# month has no data or the earlier month is 0
+def relativeChange(values, months):
+    earlier = lagged(values, months)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(earlier != 0, (values - earlier) / np.abs(earlier), np.nan)
+
+# This function computes, along the last axis, how many standard deviations
+# each month is from the months before it. The mean and standard deviation
+# of the window are differences of running sums of the values, their
+# squares, and the number of months with data
+# INPUT: Array whose last axis is months, NaN where there is no data; months
+#        in the window; months of data the window needs
+# OUTPUT: Array of z-scores, NaN where the window has too little data
+def rollingZScores(values, window=WINDOW_MONTHS, minHistory=MIN_HISTORY):
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    start = np.zeros(values.shape[:-1] + (1,))
+    sums = np.concatenate([start, np.cumsum(filled, axis=-1)], axis=-1)
+    squares = np.concatenate([start, np.cumsum(filled ** 2, axis=-1)], axis=-1)
+    counts = np.concatenate([start, np.cumsum(present, axis=-1)], axis=-1)
+
+    # Month t is compared with months [t - window, t)
+    end = np.arange(values.shape[-1])
+    begin = np.maximum(end - window, 0)
+    n = counts[..., end] - counts[..., begin]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (sums[..., end] - sums[..., begin]) / n
+        variance = np.maximum((squares[..., end] - squares[..., begin]) / n - mean ** 2, 0) * n / (n - 1)
+        std = np.maximum(np.sqrt(variance), STD_FLOOR * np.abs(mean))
+        z = (values - mean) / std
+    return np.where((n >= minHistory) & (std > 0), z, np.nan)
+
+# The result of scanning one grouping for anomalies
+class AnomalyScan:
+    def __init__(self, grouping, entities, periods, values, monthOverMonth, yearOverYear, zScores):
+        self.grouping = grouping
+        self.commodities = tuple(COMMODITY_UNITS)
+        self.entities = tuple(entities)
+        self.periods = periods
+        self.labels = tuple(periods.strftime(PERIOD_LABEL_FORMAT))
+        self.columnOf = {label: column for column, label in enumerate(self.labels)}
+        # Commodities x SERIES x entities x months
+        self.values = readOnly(values)
+        self.monthOverMonth = readOnly(monthOverMonth)
+        self.yearOverYear = readOnly(yearOverYear)
+        self.zScores = readOnly(zScores)
+        # Commodities x entities x months: the largest distance of a z-score
+        # from 0, NaN where there is none
+        self.scores = readOnly(np.fmax.reduce(np.abs(zScores), axis=1))
+
+    # This method returns the flagged offices or properties with the highest
+    # scores, for one month or, if label is None, each one's highest scoring
+    # month
+    # INPUT: List of commodities; month label like 'Jan_2022' or None; number
+    #        of rows; score at which a month is flagged
+    # OUTPUT: List of dictionaries, one per flagged office or property and
+    #         commodity, highest score first
+    def top(self, commodities, label, count, threshold=Z_THRESHOLD):
+        layers = np.array([self.commodities.index(c) for c in commodities], dtype=np.intp)
+        scores = self.scores[layers]
+        if label is None:
+            columns = np.argmax(np.where(np.isnan(scores), -np.inf, scores), axis=-1)
+        elif label in self.columnOf:
+            columns = np.full(scores.shape[:2], self.columnOf[label])
+        else:
+            return []
+        best = np.take_along_axis(scores, columns[..., None], axis=-1)[..., 0]
+
+        flagged = np.flatnonzero(np.nan_to_num(best, nan=-np.inf).ravel() >= threshold)
+        if len(flagged) > count:
+            flagged = flagged[np.argpartition(-best.ravel()[flagged], count - 1)[:count]]
+        flagged = flagged[np.argsort(-best.ravel()[flagged], kind='stable')]
+
+        rows = list()
+        for layer, entity in zip(*np.unravel_index(flagged, best.shape)):
+            commodity, column = layers[layer], columns[layer, entity]
+            cell = (commodity, slice(None), entity, column)
+            z = self.zScores[cell]
+            rows.append({
+                'entity': self.entities[entity],
+                'commodity': self.commodities[commodity],
+                'month': self.labels[column],
+                'values': self.values[cell],
+                'monthOverMonth': self.monthOverMonth[cell],
+                'yearOverYear': self.yearOverYear[cell],
+                'zScores': z,
+                'score': float(best[layer, entity]),
+                'flags': [(series, 'up' if z[i] > 0 else 'down') for i, series in enumerate(SERIES)
+                          if abs(z[i]) >= threshold],
+            })
+        return rows
+
+# This function scans every office or property (or the county) of a snapshot
+# for anomalies, both commodities at once
+# INPUT: Snapshot; grouping ('Property_Name', 'Office', or 'County')
+# OUTPUT: AnomalyScan
+@timedStage('anomalies.scan', rows=lambda scan: scan.scores.size)
+def scanAnomalies(snapshot, grouping):
+    matrices = {(c, m): snapshot.matrix(c, m, grouping) for c in COMMODITY_UNITS for m in ('usage', 'spending')}
+    entities = sorted(set().union(*(matrix.entities for matrix in matrices.values())))
+    periods = pd.period_range(min(m.periods[0] for m in matrices.values() if len(m.periods)),
+                              max(m.periods[-1] for m in matrices.values() if len(m.periods)), freq='M')
+    rowOf = {name: row for row, name in enumerate(entities)}
+
+    # Months outside a matrix, and commodities an entity has no data for,
+    # stay NaN
+    values = np.full((len(COMMODITY_UNITS), len(SERIES), len(entities), len(periods)), np.nan)
+    for (commodity, metric), matrix in matrices.items():
+        rows = np.array([rowOf[name] for name in matrix.entities], dtype=np.intp)
+        columns = periods.get_indexer(matrix.periods)
+        values[list(COMMODITY_UNITS).index(commodity), SERIES.index(metric), rows[:, None], columns] = matrix.values
+    usage, spending = values[:, 0], values[:, 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values[:, 2] = np.where(usage > 0, spending / usage, np.nan)
+
+    # The changes and z-scores are kept as float32, which is plenty for
+    # showing and ranking them and halves the memory of the scan
+    return AnomalyScan(grouping, entities, periods, values, relativeChange(values, 1).astype(np.float32),
+                       relativeChange(values, 12).astype(np.float32), rollingZScores(values).astype(np.float32))
+
+# This function returns the snapshot's scan for a grouping, running it the
+# first time it is asked for. Every row is scanned, so with a backend that
+# does not keep the matrices in memory they are built for it
+def anomalyScan(snapshot, grouping):
+    return snapshot.cached(('anomalies', grouping), lambda: scanAnomalies(snapshot, grouping))
@@ -0,0 +1,122 @@
+""" This file contains the engine behind the averages tab. For each grouping
+    (properties or offices) it builds, once per snapshot of the data, a cube
+    with one row per property or office, one column per month, and one layer
+    per measure shown in the tab (electricity spending and usage, gas spending
+    and usage). Any question the tab asks - the rows for a set of months and
+    their means, the means for every office at once, or means by calendar
+    month or season - is then answered with array operations on the cube. """
+
+import numpy as np
+from src.facts import readOnly
+
+# Measures in the order they are shown in the averages tab: (commodity,
+# metric, column name)
+MEASURES = [
+    ('electricity', 'spending', 'Electricity Spending ($)'),
+    ('electricity', 'usage', 'Electricity Usage (kWh)'),
+    ('gas', 'spending', 'Gas Spending ($)'),
+    ('gas', 'usage', 'Gas Usage (therms)'),
+]
+MEASURE_NAMES = [name for _, _, name in MEASURES]
+
+# Seasons by calendar month (1-12)
+SEASONS = ['Winter', 'Spring', 'Summer', 'Fall']
+_SEASON_OF_MONTH = np.array([0, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0])
+
+# This function takes masked means along an axis: NaNs are left out, and a
+# mean over nothing but NaNs is NaN
+def _maskedMean(values, axis):
+    present = ~np.isnan(values)
+    counts = present.sum(axis=axis)
+    sums = np.where(present, values, 0).sum(axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+# The cube for every office or property, or, given names, for just those
+class AveragesCube:
+    def __init__(self, snapshot, grouping, names=None):
+        if names is None:
+            matrices = [snapshot.matrix(c, m, grouping) for c, m, _ in MEASURES]
+        else:
+            matrices = [snapshot.selection(c, m, grouping, names) for c, m, _ in MEASURES]
+        self.grouping = grouping
+        self.entities = sorted(set().union(*(m.entities for m in matrices)))
+        self.labels = list(snapshot.dates)
+        self.rowOf = {name: row for row, name in enumerate(self.entities)}
+        self.columnOf = {label: column for column, label in enumerate(self.labels)}
+
+        # An office or property without any data for a measure shows 0, and a
+        # month the measure has no data for shows NaN. Values are rounded to
+        # cents / hundredths, as they are displayed
+        self.cube = np.full((len(self.entities), len(self.labels), len(MEASURES)), np.nan)
+        self.months = np.array([int(label[-4:]) * 12 + self._monthNumber(label) for label in self.labels])
+        for layer, matrix in enumerate(matrices):
+            rows = np.array([self.rowOf[name] for name in matrix.entities], dtype=np.intp)
+            columns = np.array([self.columnOf[label] for label in matrix.labels], dtype=np.intp)
+            self.cube[:, columns, layer] = 0
+            self.cube[np.ix_(rows, columns, [layer])] = np.round(matrix.values, 2)[:, :, None]
+        readOnly(self.cube)
+        readOnly(self.months)
+
+    @staticmethod
+    def _monthNumber(label):
+        return ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'].index(label[:3])
+
+    def _columns(self, labels):
+        return np.array([self.columnOf[label] for label in labels if label in self.columnOf], dtype=np.intp)
+
+    # This method answers the averages tab for one office or property: the
+    # values for each selected month, in the reverse of the order they were
+    # selected in, and the mean of each measure over those months
+    # INPUT: Office or property name; list of month labels like 'Jan_2022'
+    # OUTPUT: List of the month labels shown; array of months x measures;
+    #         array of the measures' means
+    def query(self, entity, labels):
+        labels = [label for label in (labels or [])[::-1] if label in self.columnOf]
+        columns = self._columns(labels)
+        row = self.rowOf.get(entity)
+        if row is None:
+            values = np.zeros((len(columns), len(MEASURES)))
+        else:
+            values = self.cube[row, columns, :]
+        return labels, values, _maskedMean(values, axis=0)
+
+    # This method returns the mean of each measure over the selected months for
+    # every office or property at once
+    # OUTPUT: Array of entities x measures, rows in the order of self.entities
+    def averagesForAll(self, labels):
+        return _maskedMean(self.cube[:, self._columns(labels), :], axis=1)
+
+    # This method returns means by calendar month (by='month', 12 groups, Jan
+    # first) or by season (by='season', in the order of SEASONS) over the
+    # selected months, for one office or property or, if entity is None, for
+    # every office or property at once
+    # OUTPUT: Array of groups x measures, or entities x groups x measures
+    def summary(self, labels, by='season', entity=None):
+        columns = self._columns(labels)
+        calendarMonths = self.months[columns] % 12
+        groups = _SEASON_OF_MONTH[calendarMonths + 1] if by == 'season' else calendarMonths
+        groupCount = len(SEASONS) if by == 'season' else 12
+        oneHot = np.zeros((groupCount, len(columns)))
+        oneHot[groups, np.arange(len(columns))] = 1
+
+        values = self.cube[:, columns, :] if entity is None else self.cube[[self.rowOf[entity]]][:, columns, :]
+        present = ~np.isnan(values)
+        sums = np.einsum('gm,emk->egk', oneHot, np.where(present, values, 0))
+        counts = np.einsum('gm,emk->egk', oneHot, present)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(counts > 0, sums / counts, np.nan)
+        return means if entity is None else means[0]
+
+# This function returns the snapshot's cube for a grouping, building it the
+# first time it is asked for
+def averagesCube(snapshot, grouping):
+    return snapshot.cached(('averages', grouping), lambda: AveragesCube(snapshot, grouping))
+
+# This function returns a cube that holds the given office or property: the
+# snapshot's cube when its matrices are kept in memory, otherwise a cube of
+# just that office or property, read through the snapshot's backend
+def entityCube(snapshot, grouping, entity):
+    if snapshot.backend.inMemory:
+        return averagesCube(snapshot, grouping)
+    return AveragesCube(snapshot, grouping, [entity])
@@ -0,0 +1,338 @@
+""" This file contains the storage backends the callbacks read the energy data
+    through. A callback asks its snapshot for the rows of the offices or
+    properties it shows (Snapshot.selection in store.py), and the snapshot's
+    backend answers:
+
+        memory  (the default) picks the rows out of the snapshot's matrices,
+                which are built in memory the first time they are used
+        sqlite  runs a narrow query against an SQLite database that holds
+                the fact table, with each property's office, indexed by
+                property or office and month
+
+    ENERGY_BACKEND picks the backend and ENERGY_SQLITE_PATH the database file
+    (default data/energy.sqlite, outside the Excel cache folder so clearing
+    the cache does not delete a database the workers have open). With
+    sqlite, each commodity's data is stored as a generation named by a
+    fingerprint of its facts and the property -> office mapping. A new
+    snapshot only writes the generations that are not in the database yet,
+    so processes that load the same data write it once and share one
+    database, and a snapshot only ever queries its own generations, so like
+    the memory backend it keeps seeing the data it was built from while a
+    newer snapshot is written and swapped in.
+
+    Each process records in the readers table the generations its snapshots
+    use, and a snapshot's rows are removed once it is garbage collected (or
+    its process has exited). A write then drops the generations no reader
+    uses any more. The matrices, tables, and projections the memory backend
+    keeps for every view are never built, so a process only holds the rows
+    it is serving. """
+
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import weakref
+import numpy as np
+import pandas as pd
+from src.facts import COMMODITY_UNITS, COUNTY, GROUPING_COLUMNS, METRIC_COLUMNS, EntityMatrix, matrixFacts
+from src.metrics import timed
+
+# Backend the store reads through, 'memory' or 'sqlite'
+BACKEND = os.environ.get('ENERGY_BACKEND', 'memory')
+
+# Database file of the sqlite backend
+SQLITE_PATH = os.environ.get('ENERGY_SQLITE_PATH', './data/energy.sqlite')
+
+# Version of what is written to the database. Databases written with another
+# version are rewritten
+DATABASE_FORMAT = 3
+
+# Months are stored as the number of months since January of year 0. Every
+# row of facts, entities, and months belongs to one generation of one
+# commodity's data
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS generations (
+    generation TEXT PRIMARY KEY,
+    commodity TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS facts (
+    generation TEXT NOT NULL,
+    property TEXT NOT NULL,
+    office TEXT,
+    period INTEGER NOT NULL,
+    usage REAL,
+    spend REAL
+);
+CREATE INDEX IF NOT EXISTS facts_by_property ON facts (generation, property, period, usage, spend);
+CREATE INDEX IF NOT EXISTS facts_by_office ON facts (generation, office, period, usage, spend);
+CREATE INDEX IF NOT EXISTS facts_by_period ON facts (generation, period);
+CREATE TABLE IF NOT EXISTS entities (
+    generation TEXT NOT NULL,
+    grouping TEXT NOT NULL,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (generation, grouping, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS months (
+    generation TEXT NOT NULL,
+    grouping TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    period INTEGER NOT NULL,
+    PRIMARY KEY (generation, grouping, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS readers (
+    pid INTEGER NOT NULL,
+    snapshot INTEGER NOT NULL,
+    generation TEXT NOT NULL,
+    PRIMARY KEY (pid, snapshot, generation)
+) WITHOUT ROWID;
+'''
+
+# Tables holding the rows of each generation
+GENERATION_TABLES = ('facts', 'entities', 'months')
+
+def _monthNumbers(periods):
+    return (periods.year * 12 + periods.month - 1).to_numpy()
+
+def _periodsOf(monthNumbers):
+    return pd.PeriodIndex([pd.Period(year=n // 12, month=n % 12 + 1, freq='M') for n in monthNumbers])
+
+# This function returns a fingerprint of a dataframe's contents
+def _fingerprint(df):
+    return str(int(pd.util.hash_pandas_object(df, index=False).sum() % 2**63)) + f'-{len(df)}'
+
+# This function tells whether the process with the given id is running
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Reads the data straight from the snapshot's matrices
+class MemoryBackend:
+    name = 'memory'
+    # Whether the snapshot's matrices are what the callbacks read, so they
+    # are worth building and keeping
+    inMemory = True
+
+    def write(self, snapshot):
+        pass
+
+    def selection(self, snapshot, commodity, metric, grouping, names):
+        return snapshot.matrix(commodity, metric, grouping).subset(names)
+
+    def names(self, snapshot, commodity, grouping):
+        return snapshot.matrix(commodity, 'usage', grouping).entities
+
+# Reads the data from an SQLite database with narrow, indexed queries
+class SqliteBackend:
+    name = 'sqlite'
+    inMemory = False
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        # Snapshot -> (its number in this process, commodity -> generation)
+        # for every snapshot written that is still alive
+        self._snapshots = weakref.WeakKeyDictionary()
+        self._numbers = itertools.count(1)
+        # Numbers of the snapshots garbage collected since the last write
+        self._released = list()
+        self._pid = os.getpid()
+
+    # Each thread of each process opens its own connection, as SQLite
+    # connections cannot be shared between threads or across a fork
+    def _connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            local.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            self._transaction(local.connection, self._createSchema)
+            local.pid = os.getpid()
+        # A forked process (e.g. a gunicorn worker) reads the snapshots it
+        # inherited, so it records itself as their reader too
+        if self._pid != os.getpid():
+            inherited = list(self._snapshots.values())
+            self._transaction(local.connection, lambda connection: self._addReaders(connection, inherited))
+            self._pid = os.getpid()
+        return local.connection
+
+    # This method runs write(connection) in one write transaction, so other
+    # connections see either all of it or none of it
+    # OUTPUT: What write returns
+    @staticmethod
+    def _transaction(connection, write):
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = write(connection)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return result
+
+    # This method creates the tables, first dropping the ones written with
+    # another DATABASE_FORMAT
+    @staticmethod
+    def _createSchema(connection):
+        if connection.execute('PRAGMA user_version').fetchone()[0] != DATABASE_FORMAT:
+            tables = connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()
+            for (table,) in tables:
+                connection.execute(f'DROP TABLE "{table}"')
+            connection.execute(f'PRAGMA user_version = {DATABASE_FORMAT}')
+        for statement in SCHEMA.split(';'):
+            if statement.strip():
+                connection.execute(statement)
+
+    # This method writes the generations of the snapshot's data that are not
+    # in the database yet, records that this process reads them, and drops
+    # the generations no snapshot reads any more
+    def write(self, snapshot):
+        connection = self._connection()
+        mapping = snapshot.propNamesAndOffices.drop_duplicates(subset='Property_Name')
+        mappingFingerprint = _fingerprint(mapping[['Property_Name', 'Office']])
+        # Offices are attached to the facts, so a new mapping makes a new
+        # generation of every commodity
+        generations = {commodity: f'{commodity}:{_fingerprint(snapshot.commodityFacts(commodity))}/{mappingFingerprint}'
+                       for commodity in COMMODITY_UNITS}
+        number = next(self._numbers)
+        released = list()
+        while self._released:
+            released.append(self._released.pop())
+
+        def write(connection):
+            written = 0
+            stored = {generation for (generation,) in connection.execute('SELECT generation FROM generations')}
+            for commodity, generation in generations.items():
+                if generation not in stored:
+                    written += self._writeGeneration(connection, snapshot.facts, commodity, generation)
+            self._addReaders(connection, [(number, generations)])
+            self._dropUnused(connection, released)
+            return written
+
+        with timed('backend.sqlite_write') as timing:
+            try:
+                timing.rows = self._transaction(connection, write)
+            except BaseException:
+                self._released.extend(released)
+                raise
+        self._snapshots[snapshot] = (number, generations)
+        weakref.finalize(snapshot, self._released.append, number)
+
+    # This method records this process as the reader of the generations of
+    # the given (number, commodity -> generation) snapshots
+    @staticmethod
+    def _addReaders(connection, snapshots):
+        connection.executemany('INSERT OR IGNORE INTO readers VALUES (?, ?, ?)', (
+            (os.getpid(), number, generation)
+            for number, generations in snapshots for generation in generations.values()))
+
+    # This method removes the readers of the given snapshots of this process
+    # and of processes that have exited, and drops every generation that is
+    # left without a reader
+    @staticmethod
+    def _dropUnused(connection, released):
+        connection.executemany('DELETE FROM readers WHERE pid = ? AND snapshot = ?',
+                               ((os.getpid(), number) for number in released))
+        pids = [pid for (pid,) in connection.execute('SELECT DISTINCT pid FROM readers')]
+        connection.executemany('DELETE FROM readers WHERE pid = ?', ((pid,) for pid in pids if not _running(pid)))
+        unused = connection.execute(
+            'SELECT generation FROM generations WHERE generation NOT IN (SELECT generation FROM readers)').fetchall()
+        for table in GENERATION_TABLES + ('generations',):
+            connection.executemany(f'DELETE FROM {table} WHERE generation = ?', unused)
+
+    # This method writes one generation of a commodity's data: its facts,
+    # and the names and months of its matrices, which are stored in the
+    # order of the matrices built in rollup.py
+    # OUTPUT: Number of facts written
+    @staticmethod
+    def _writeGeneration(connection, facts, commodity, generation):
+        rows = facts[facts['commodity'] == commodity]
+        connection.execute('INSERT INTO generations VALUES (?, ?)', (generation, commodity))
+        offices = rows['office'].astype(object).where(rows['office'].notna(), None)
+        connection.executemany('INSERT INTO facts VALUES (?, ?, ?, ?, ?, ?)', zip(
+            [generation] * len(rows), rows['property'].astype(str), offices,
+            _monthNumbers(rows['period'].dt).tolist(),
+            rows['usage'].astype(float).tolist(), rows['spend'].astype(float).tolist()))
+
+        for grouping, key in GROUPING_COLUMNS.items():
+            grouped = matrixFacts(facts, commodity, grouping)
+            _, entities = pd.factorize(grouped[key], sort=True)
+            _, periods = pd.factorize(grouped['period'], sort=True)
+            connection.executemany('INSERT INTO entities VALUES (?, ?, ?, ?)',
+                                   ((generation, grouping, str(name), i) for i, name in enumerate(entities)))
+            connection.executemany('INSERT INTO months VALUES (?, ?, ?, ?)', (
+                (generation, grouping, i, int(n)) for i, n in enumerate(_monthNumbers(pd.PeriodIndex(periods)))))
+        # The county has one row and every month
+        connection.execute('INSERT INTO entities VALUES (?, ?, ?, 0)', (generation, 'County', COUNTY))
+        connection.execute('INSERT INTO months SELECT ?, ?, ROW_NUMBER() OVER (ORDER BY period) - 1, period'
+                           ' FROM (SELECT DISTINCT period FROM facts WHERE generation = ?)',
+                           (generation, 'County', generation))
+        return len(rows)
+
+    # This method returns the generation of a commodity's data that a
+    # snapshot reads
+    def _generation(self, snapshot, commodity):
+        return self._snapshots[snapshot][1][commodity]
+
+    # This method returns the rows of the given offices or properties, with
+    # every month of the commodity, like the memory backend's subset of the
+    # full matrix: months without data are NaN for a property and 0 for an
+    # office or the county, whose bills are summed
+    # OUTPUT: EntityMatrix
+    def selection(self, snapshot, commodity, metric, grouping, names):
+        connection = self._connection()
+        generation = self._generation(snapshot, commodity)
+        metricColumn = METRIC_COLUMNS[metric]
+        selected = json.dumps([n for n in set(names or []) if isinstance(n, str)])
+        with timed('backend.sqlite_query') as timing:
+            found = connection.execute(
+                'SELECT name, position FROM entities WHERE generation = ? AND grouping = ?'
+                ' AND name IN (SELECT value FROM json_each(?)) ORDER BY position',
+                (generation, grouping, selected)).fetchall()
+            monthNumbers = [n for (n,) in connection.execute(
+                'SELECT period FROM months WHERE generation = ? AND grouping = ? ORDER BY position',
+                (generation, grouping))]
+            entities = [name for name, _ in found]
+            if grouping == 'Property_Name':
+                query = (f'SELECT property, period, {metricColumn} FROM facts WHERE generation = ?'
+                         ' AND property IN (SELECT value FROM json_each(?))')
+                parameters = (generation, json.dumps(entities))
+            elif grouping == 'Office':
+                query = (f'SELECT office, period, SUM({metricColumn}) FROM facts WHERE generation = ?'
+                         ' AND office IN (SELECT value FROM json_each(?)) GROUP BY office, period')
+                parameters = (generation, json.dumps(entities))
+            else:
+                query = f'SELECT ?, period, SUM({metricColumn}) FROM facts WHERE generation = ? GROUP BY period'
+                parameters = (COUNTY, generation)
+            facts = connection.execute(query, parameters).fetchall() if entities else []
+            timing.rows = len(facts)
+
+        rowOf = {name: row for row, name in enumerate(entities)}
+        columnOf = {n: column for column, n in enumerate(monthNumbers)}
+        values = np.full((len(entities), len(monthNumbers)), np.nan if grouping == 'Property_Name' else 0.0)
+        if facts:
+            names, months, amounts = zip(*facts)
+            values[[rowOf[n] for n in names], [columnOf[m] for m in months]] = amounts
+        return EntityMatrix(entities, _periodsOf(monthNumbers), values, [position for _, position in found])
+
+    # This method returns every office or property (or the county) that has
+    # data for a commodity, in matrix order
+    def names(self, snapshot, commodity, grouping):
+        return tuple(name for (name,) in self._connection().execute(
+            'SELECT name FROM entities WHERE generation = ? AND grouping = ? ORDER BY position',
+            (self._generation(snapshot, commodity), grouping)))
+
+BACKENDS = {'memory': MemoryBackend, 'sqlite': SqliteBackend}
+
+# This function returns the backend with the given name
+def makeBackend(name=BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown ENERGY_BACKEND {name!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
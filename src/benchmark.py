@@ -0,0 +1,154 @@
+""" This file benchmarks ingestion and the dashboard's callbacks. It times
+    readEnergyExcelFiles (parsing a workbook, and loading it from the Excel
+    cache), streaming just the sheets and columns used (excel_stream.py),
+    building the data store, aggregateYears, and each server-side
+    callback called directly, and appends the results, with the commit they
+    were measured at, to a JSON lines file. Each run is compared with the
+    last one recorded for the same data, so a regression shows up as a stage
+    that got slower.
+
+        python -m src.benchmark --generate 2000 --years 3
+        python -m src.benchmark --dir OUT_DIR
+
+    --generate writes synthetic workbooks of that many properties (see
+    synthetic.py) into --dir first. The data folder and offices file are
+    taken from --dir, which must hold data/ and propertyNamesAndOffices.xlsx
+    like the repository. """
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import time
+
+RESULTS_FILE = 'benchmarks.jsonl'
+
+# This function times a function, returning the median and fastest of a
+# number of runs in seconds. setup() is run untimed before each run
+def timeIt(func, repeat, setup=None):
+    times = list()
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'median': statistics.median(times), 'min': min(times)}
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# This function runs every benchmark on the data the environment points at.
+# The src modules read their settings when imported, so they are imported
+# here, after main() has set the environment
+# OUTPUT: Dictionary mapping each stage to its timings
+def runBenchmarks(repeat):
+    import src.functions as fcns
+    from src.callback_cache import callbackCache
+    from src.excel_stream import readSheetColumns
+    from src.facts import COMMODITY_UNITS
+    from src.loader import discoverWorkbooks, isFiscalYearSheet, neededWorkbooks
+    from src.store import DataStore, store
+    from src.components.charts_and_tables.main_chart import update_chart
+    from src.components.charts_and_tables.main_table import update_table
+    from src.anomalies import scanAnomalies
+    from main import create_app
+    import src.components.layout.ids as ids
+
+    results = dict()
+    workbooks = neededWorkbooks(discoverWorkbooks())
+    newest = workbooks[-1]
+    results['readEnergyExcelFiles.parse'] = timeIt(lambda: fcns.readEnergyExcelFiles(newest.name, rebuild=True), repeat)
+    results['readEnergyExcelFiles.cached'] = timeIt(lambda: fcns.readEnergyExcelFiles(newest.name), repeat)
+    results['readSheetColumns.parse'] = timeIt(
+        lambda: readSheetColumns(newest.path, COMMODITY_UNITS[newest.commodity],
+                                 lambda sheet: isFiscalYearSheet(sheet, newest.year)), repeat)
+    results['store.build'] = timeIt(lambda: DataStore().snapshot, repeat)
+
+    # The dataframes are built from the snapshot's matrices on every call of
+    # aggregateYears
+    store.warm()
+    for commodity in ('electricity', 'gas'):
+        for grouping in ('Property_Name', 'Office'):
+            results[f'aggregateYears.{commodity}.{grouping}'] = timeIt(
+                lambda: fcns.aggregateYears(commodity, grouping), repeat)
+
+    # Callbacks, called directly with every property or office selected. The
+    # callback cache is cleared before each run, so the work is measured
+    app = create_app()
+    callbacks = {key: value['callback'].__wrapped__ for key, value in app.callback_map.items() if 'callback' in value}
+    snapshot = store.snapshot
+    results['callback.options'] = timeIt(lambda: callbacks[ids.OPTIONS_STORE + '.data']('/'), repeat)
+    for grouping, names in (('Property_Name', snapshot.properties), ('Office', snapshot.offices)):
+        results[f'callback.chart.{grouping}'] = timeIt(
+            lambda: update_chart(snapshot, 'electricity', 'usage', grouping, list(names), None), repeat, callbackCache.clear)
+        results[f'callback.table.{grouping}'] = timeIt(
+            lambda: update_table(snapshot, list(names), 'electricity', 'usage', grouping, 0, 17, [], ''), repeat,
+            callbackCache.clear)
+        offOrProp = 'Property' if grouping == 'Property_Name' else 'Office'
+        results[f'callback.ave_table.{grouping}'] = timeIt(
+            lambda: callbacks[ids.AVE + '.children'](offOrProp, names[0], list(snapshot.dates)), repeat,
+            callbackCache.clear)
+        results[f'anomalies.scan.{grouping}'] = timeIt(lambda: scanAnomalies(snapshot, grouping), repeat)
+        results[f'callback.anomaly_table.{grouping}'] = timeIt(
+            lambda: callbacks[ids.ANOMALIES + '.children'](offOrProp, 'Both', 'All', 100), repeat,
+            callbackCache.clear)
+    results['_scale'] = {'workbooks': len(workbooks), 'properties': len(snapshot.properties),
+                         'offices': len(snapshot.offices), 'months': len(snapshot.dates),
+                         'facts': len(snapshot.facts)}
+    return results
+
+# This function prints the results next to the last run recorded for the same
+# data, if there is one
+def report(results, previous):
+    print('%-45s %10s %10s %9s' % ('stage', 'median s', 'min s', 'change'))
+    for stage, timing in results.items():
+        if stage.startswith('_'):
+            continue
+        change = ''
+        if previous and stage in previous['results'] and previous['results'][stage]['median'] > 0:
+            change = '%+8.1f%%' % (100 * (timing['median'] / previous['results'][stage]['median'] - 1))
+        print('%-45s %10.4f %10.4f %9s' % (stage, timing['median'], timing['min'], change))
+    if previous:
+        print(f"compared with {previous['commit']} at {previous['time']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ingestion and callbacks')
+    parser.add_argument('--dir', default='.', help='folder holding data/ and propertyNamesAndOffices.xlsx')
+    parser.add_argument('--generate', type=int, metavar='PROPERTIES',
+                        help='write synthetic workbooks with this many properties into --dir first')
+    parser.add_argument('--years', type=int, default=3, help='fiscal years to generate and load')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--results', default=RESULTS_FILE, help='JSON lines file the results are added to')
+    args = parser.parse_args()
+
+    if args.generate:
+        from src.synthetic import generate
+        generate(args.dir, properties=args.generate, years=args.years)
+    directory = os.path.abspath(args.dir)
+    os.environ['ENERGY_DATA_DIR'] = os.path.join(directory, 'data')
+    os.environ['ENERGY_OFFICES_FILE'] = os.path.join(directory, 'propertyNamesAndOffices.xlsx')
+    os.environ['ENERGY_HISTORY_YEARS'] = str(args.years)
+    os.environ['ENERGY_WATCH_INTERVAL'] = '0'
+
+    results = runBenchmarks(args.repeat)
+    record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': gitCommit(), 'dir': directory,
+              'repeat': args.repeat, 'scale': results.pop('_scale'), 'results': results}
+
+    previous = None
+    if os.path.exists(args.results):
+        with open(args.results) as f:
+            runs = [json.loads(line) for line in f if line.strip()]
+        matching = [r for r in runs if r['dir'] == directory and r['scale'] == record['scale']]
+        previous = matching[-1] if matching else None
+    report(results, previous)
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+if __name__ == '__main__':
+    main()
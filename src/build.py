@@ -0,0 +1,37 @@
+""" This file builds a data bundle (see bundle.py) from the workbooks in the
+    data folder and the propertyNamesAndOffices file, so the dashboard's
+    processes can open the data memory-mapped instead of each ingesting it:
+
+        python -m src.build
+
+    Run it from the folder the dashboard runs from, or point it at the files
+    with its options (which default to ENERGY_DATA_DIR, ENERGY_OFFICES_FILE,
+    ENERGY_HISTORY_YEARS, and ENERGY_BUNDLE_DIR, like the dashboard). Run it
+    again after the workbooks change; until then the dashboard ingests the
+    changed workbooks itself. """
+
+import argparse
+import time
+from src.backends import MemoryBackend
+from src.bundle import BUNDLE_DIR, sourceStats, writeBundle
+from src.loader import DATA_DIR, HISTORY_YEARS, OFFICES_FILE
+from src.store import DataStore
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a memory-mapped data bundle from the workbooks')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='folder holding the workbooks')
+    parser.add_argument('--offices-file', default=OFFICES_FILE, help='propertyNamesAndOffices workbook')
+    parser.add_argument('--years', default=HISTORY_YEARS, help="fiscal years to load, or 'all'")
+    parser.add_argument('--out', default=BUNDLE_DIR, help='folder the bundle is written to')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = DataStore(args.data_dir, args.offices_file, args.years, backend=MemoryBackend(), bundleDir=None)
+    # The files are looked at before they are read, so a workbook changed
+    # during the build makes the bundle out of date rather than wrong
+    sources = sourceStats(store.sourcePaths())
+    path = writeBundle(store.snapshot, sources, args.out)
+    print(f'Wrote {path} from {len(sources)} files in {time.perf_counter() - start:.1f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+""" This file writes and opens data bundles: the ingested data saved as NumPy
+    arrays, so a server process can start without reading any workbook.
+
+        python -m src.build
+
+    ingests the workbooks once (see build.py) and writes a bundle with, for
+    each commodity, the property, office, and county cubes of its rollup
+    (see rollup.py) and the columns of its facts as .npy files, next to
+    small index files holding the property and office names and the months.
+    At startup the store opens the newest bundle with np.load(mmap_mode='r')
+    instead of ingesting, so startup only reads the index files, and every
+    process on the host that opens the same bundle shares one copy of its
+    arrays in the page cache. The facts are only turned back into a
+    dataframe the first time a snapshot needs them (see Snapshot.facts in
+    store.py), which the matrices the dashboard shows never do.
+
+    Each build is written to a new folder under ENERGY_BUNDLE_DIR (default
+    data/.bundle, outside the Excel cache folder so clearing the cache does
+    not delete it), and the CURRENT file there names the newest one, so a
+    build never changes the files a running process has mapped. A bundle
+    records the size and modification time of the workbooks and
+    propertyNamesAndOffices file it was built from; if any of them has
+    changed since, it is not opened and the store ingests the workbooks as
+    usual. """
+
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from src.facts import COMMODITY_UNITS
+from src.metrics import timed
+from src.rollup import Rollup
+
+logger = logging.getLogger(__name__)
+
+# Folder the bundles are written to and opened from
+BUNDLE_DIR = os.environ.get('ENERGY_BUNDLE_DIR', './data/.bundle')
+
+# Version of the bundle layout. Bundles written with another version are
+# not opened
+BUNDLE_FORMAT = 2
+
+# Number of bundles kept in the folder; older ones are deleted by a new build
+KEEP_BUNDLES = 2
+
+# Arrays of each commodity: the rollup's cubes, office codes, and the months
+# its offices have data for, and the columns of its facts (property as a row
+# of properties.json, period as a month ordinal)
+ROLLUP_ARRAYS = ('property_cube', 'office_cube', 'county_cube', 'codes', 'office_months')
+FACT_ARRAYS = ('facts_property', 'facts_period', 'facts_usage', 'facts_spend')
+
+# This function returns the size and modification time of each file a
+# bundle is built from
+# INPUT: List of paths
+# OUTPUT: Dictionary mapping each absolute path to [size, mtime_ns]
+def sourceStats(paths):
+    stats = dict()
+    for path in paths:
+        stat = os.stat(path)
+        stats[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+def _writeJson(filename, content):
+    with open(filename, 'w') as f:
+        json.dump(content, f)
+
+def _readJson(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+# This function writes one commodity's rollup and facts into a folder
+def _writeCommodity(folder, rollup, facts):
+    os.makedirs(folder)
+    _writeJson(os.path.join(folder, 'properties.json'), list(rollup.properties))
+    _writeJson(os.path.join(folder, 'offices.json'), list(rollup.offices))
+    np.save(os.path.join(folder, 'periods.npy'), rollup.periods.asi8)
+    arrays = {
+        'property_cube': rollup.propertyCube,
+        'office_cube': rollup.officeCube,
+        'county_cube': rollup.countyCube,
+        'codes': rollup.codes,
+        'office_months': rollup.officeMonths,
+        # Facts without a property (none after cleaning) get -1
+        'facts_property': pd.Index(rollup.properties).get_indexer(facts['property']).astype(np.int32),
+        'facts_period': facts['period'].array.asi8,
+        'facts_usage': facts['usage'].to_numpy(np.float64),
+        'facts_spend': facts['spend'].to_numpy(np.float64),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(folder, name + '.npy'), np.ascontiguousarray(array))
+
+# This function writes a snapshot as a new bundle and makes it the current one
+# INPUT: Snapshot; sourceStats of the files it was built from; bundle folder
+# OUTPUT: Path of the new bundle
+def writeBundle(snapshot, sources, root=BUNDLE_DIR):
+    name = time.strftime('%Y%m%d-%H%M%S') + f'-{os.getpid()}'
+    final = os.path.join(root, name)
+    tmp = final + '.tmp'
+    with timed('ingest.bundle_write') as timing:
+        os.makedirs(tmp)
+        try:
+            for commodity in COMMODITY_UNITS:
+                _writeCommodity(os.path.join(tmp, commodity), snapshot.rollup(commodity),
+                                snapshot.commodityFacts(commodity))
+            mapping = snapshot.propNamesAndOffices
+            _writeJson(os.path.join(tmp, 'mapping.json'),
+                       {column: mapping[column].tolist() for column in ('Property_Name', 'Office')})
+            _writeJson(os.path.join(tmp, 'manifest.json'),
+                       {'format': BUNDLE_FORMAT, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'sources': sources})
+            os.replace(tmp, final)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        current = os.path.join(root, 'CURRENT')
+        with open(current + '.tmp', 'w') as f:
+            f.write(name)
+        os.replace(current + '.tmp', current)
+        timing.rows = sum(len(f) for f in snapshot.factsByCommodity.values())
+    _pruneBundles(root, name)
+    return final
+
+# Deletes all but the newest bundles. Processes that still have an older
+# bundle mapped keep reading it until they exit
+def _pruneBundles(root, current):
+    names = sorted(n for n in os.listdir(root) if os.path.isdir(os.path.join(root, n)) and not n.endswith('.tmp'))
+    for name in names[:-KEEP_BUNDLES]:
+        if name != current:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def _load(folder, name):
+    return np.asarray(np.load(os.path.join(folder, name + '.npy'), mmap_mode='r'))
+
+def _periods(ordinals):
+    return pd.PeriodIndex(pd.arrays.PeriodArray(np.asarray(ordinals, dtype=np.int64), dtype='period[M]'))
+
+# This function reads one commodity's facts back from a bundle
+# OUTPUT: Facts dataframe like commodityFacts returns
+def _loadFacts(folder, properties):
+    with timed('ingest.bundle_facts') as timing:
+        arrays = {name: _load(folder, name) for name in FACT_ARRAYS}
+        # Code -1 picks the None at the end
+        names = np.array(list(properties) + [None], dtype=object)
+        facts = pd.DataFrame({'property': names[arrays['facts_property']],
+                              'period': _periods(arrays['facts_period']),
+                              'usage': arrays['facts_usage'], 'spend': arrays['facts_spend']})
+        timing.rows = len(facts)
+    return facts
+
+# This function opens one commodity's folder of a bundle. Only the rollup's
+# arrays are mapped; the facts are read when the returned function is called
+# OUTPUT: Rollup; function that returns the facts dataframe
+def _openCommodity(folder):
+    properties = _readJson(os.path.join(folder, 'properties.json'))
+    offices = tuple(_readJson(os.path.join(folder, 'offices.json')))
+    periods = _periods(np.load(os.path.join(folder, 'periods.npy')))
+    arrays = {name: _load(folder, name) for name in ROLLUP_ARRAYS}
+    rollup = Rollup(properties, periods, arrays['property_cube'], arrays['codes'], offices,
+                    arrays['office_cube'], arrays['county_cube'], arrays['office_months'])
+    return rollup, lambda: _loadFacts(folder, rollup.properties)
+
+# This function opens the current bundle if it was built from the given files
+# as they are now
+# INPUT: List of paths of the files the data is built from; bundle folder
+# OUTPUT: Dictionary with the factsByCommodity (commodity -> function that
+#         reads its facts), propNamesAndOffices, and rollups (commodity ->
+#         Rollup) of the bundle, or None if there is no current bundle or it
+#         is out of date
+def openBundle(paths, root=BUNDLE_DIR):
+    try:
+        with open(os.path.join(root, 'CURRENT')) as f:
+            folder = os.path.join(root, f.read().strip())
+        manifest = _readJson(os.path.join(folder, 'manifest.json'))
+        sources = sourceStats(paths)
+    except OSError:
+        return None
+    if manifest.get('format') != BUNDLE_FORMAT:
+        logger.info('Not opening data bundle %s, it was written by another version', folder)
+        return None
+    if manifest.get('sources') != sources:
+        logger.info('Not opening data bundle %s, the workbooks have changed since it was built', folder)
+        return None
+
+    with timed('ingest.bundle_open') as timing:
+        factsByCommodity, rollups = dict(), dict()
+        for commodity in COMMODITY_UNITS:
+            rollups[commodity], factsByCommodity[commodity] = _openCommodity(os.path.join(folder, commodity))
+        propNamesAndOffices = pd.DataFrame(_readJson(os.path.join(folder, 'mapping.json')), dtype=object)
+        timing.rows = sum(len(rollup.properties) for rollup in rollups.values())
+    logger.info('Opened data bundle %s', folder)
+    return {'factsByCommodity': factsByCommodity, 'propNamesAndOffices': propNamesAndOffices, 'rollups': rollups}
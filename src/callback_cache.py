@@ -0,0 +1,133 @@
+""" This file contains a server-side cache for the results of the Dash
+    callbacks that build the charts and tables. Results are keyed on the
+    callback's name, its inputs, and the version of the data they were built
+    from, so a result is never served after the data has been reloaded. The
+    cache holds at most a set number of results and a set number of bytes
+    (measured as the size of the JSON sent to the browser), and evicts the
+    least recently used results first. Hit, miss, and eviction counts are
+    kept so the cache can be tuned. """
+
+import functools
+import json
+import os
+import threading
+from collections import OrderedDict
+import plotly
+from src.metrics import registry
+from src.store import Snapshot, store
+
+# Limits of the cache, set with ENERGY_CALLBACK_CACHE_ENTRIES and
+# ENERGY_CALLBACK_CACHE_MB
+MAX_ENTRIES = int(os.environ.get('ENERGY_CALLBACK_CACHE_ENTRIES', '256'))
+MAX_BYTES = int(float(os.environ.get('ENERGY_CALLBACK_CACHE_MB', '64')) * 1024 * 1024)
+
+# This function returns the size of a callback result as it is sent to the
+# browser
+def payloadBytes(value):
+    return len(json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder))
+
+class CallbackCache:
+    def __init__(self, maxEntries=MAX_ENTRIES, maxBytes=MAX_BYTES):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # This method returns (True, value) for a cached key and marks it as
+    # recently used, or (False, None) if the key is not cached
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+
+    # This method stores a value, evicting the least recently used values
+    # until the cache is within its limits. Values bigger than the whole cache
+    # are not stored
+    def put(self, key, value, size):
+        if size > self.maxBytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.maxEntries or self._bytes > self.maxBytes:
+                _, (_, evictedSize) = self._entries.popitem(last=False)
+                self._bytes -= evictedSize
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+# The cache shared by all callbacks. Results built from an older version of
+# the data can never be hit again, so they are dropped when the data reloads
+callbackCache = CallbackCache()
+store.onReload(lambda snapshot: callbackCache.clear())
+for _stat in ('entries', 'bytes', 'hits', 'misses', 'evictions'):
+    registry.gauge(f'energy_callback_cache_{_stat}', f'Callback cache {_stat}',
+                   lambda stat=_stat: callbackCache.stats()[stat])
+
+# Lists (e.g. the selected properties) become tuples and dictionaries (e.g. a
+# table's sort_by) become tuples of their items, so they can be part of a key.
+# Arguments listed in unordered are sorted, for inputs whose order does not
+# change the result
+def _hashable(arg):
+    if isinstance(arg, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in arg.items()))
+    if isinstance(arg, (list, tuple)):
+        return tuple(_hashable(a) for a in arg)
+    return arg
+
+def _normalize(args, unordered):
+    normalized = list()
+    for i, arg in enumerate(args):
+        if isinstance(arg, (list, tuple)):
+            arg = tuple(sorted(_hashable(arg), key=str)) if i in unordered else _hashable(arg)
+        else:
+            arg = _hashable(arg)
+        normalized.append(arg)
+    return tuple(normalized)
+
+# This decorator caches a callback's results in callbackCache. Put it below
+# @app.callback. A function whose first argument is the Snapshot it reads is
+# keyed on that snapshot's version, otherwise on the store's
+# INPUT: Name of the callback; positions of arguments whose order does not
+#        matter
+def cachedCallback(name, unordered=()):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            if args and isinstance(args[0], Snapshot):
+                version, keyArgs = args[0].version, (None,) + args[1:]
+            else:
+                version, keyArgs = store.version, args
+            key = (name, version, _normalize(keyArgs, unordered))
+            found, value = callbackCache.get(key)
+            if found:
+                return value
+            value = func(*args)
+            callbackCache.put(key, value, payloadBytes(value))
+            return value
+        return wrapper
+    return decorator
@@ -0,0 +1,106 @@
+""" This file renders the table that is depicted in the anomalies tab of the
+    dashboard: the offices or properties whose bills in the chosen month
+    stand out most from their own history, as scored by anomalies.py. The
+    scan of every office or property is kept per snapshot of the data, so
+    the callback only picks the top rows out of it. """
+
+from dash import Dash, html, dash_table, no_update
+from dash.dependencies import Input, Output
+import numpy as np
+from src.store import store
+from src.anomalies import WINDOW_MONTHS, Z_THRESHOLD, anomalyScan
+from src.facts import COMMODITY_UNITS
+import src.components.layout.ids as ids
+from src.components.dropdowns.anomaly_tab_dropdowns import ALL_MONTHS
+from src.callback_cache import cachedCallback
+from src.metrics import timed
+
+# Commodities chosen by each option of the commodity dropdown
+COMMODITIES = {'Both': list(COMMODITY_UNITS), 'Electricity': ['electricity'], 'Gas': ['gas']}
+
+# Text shown for each series in the Flags column
+FLAG_NAMES = {'usage': 'Usage', 'spending': 'Spending', 'unit cost': 'Cost per unit'}
+
+def _number(value):
+    return None if np.isnan(value) else float(value)
+
+# This function turns the rows returned by AnomalyScan.top into table records
+def to_records(first_column, rows):
+    records = list()
+    for row in rows:
+        values, z = row['values'], row['zScores']
+        records.append({
+            first_column: row['entity'],
+            'Commodity': row['commodity'].capitalize(),
+            'Month': row['month'],
+            'Unit': COMMODITY_UNITS[row['commodity']],
+            'Usage': _number(values[0]),
+            'Spending ($)': _number(values[1]),
+            'Cost per Unit ($)': _number(values[2]),
+            'Usage MoM': _number(row['monthOverMonth'][0]),
+            'Usage YoY': _number(row['yearOverYear'][0]),
+            'Spending MoM': _number(row['monthOverMonth'][1]),
+            'Spending YoY': _number(row['yearOverYear'][1]),
+            'Usage z': _number(z[0]),
+            'Spending z': _number(z[1]),
+            'Cost per Unit z': _number(z[2]),
+            'Flags': ', '.join(f'{FLAG_NAMES[series]} {direction}' for series, direction in row['flags']),
+        })
+    return records
+
+def render(app: Dash):
+    @app.callback(
+        Output(ids.ANOMALIES, "children"),
+        Input(ids.ANOMALY_GROUPING, "value"),
+        Input(ids.ANOMALY_COMMODITY, "value"),
+        Input(ids.ANOMALY_MONTH, "value"),
+        Input(ids.ANOMALY_COUNT, "value")
+    )
+    @cachedCallback('anomaly_table')
+    def update_anomaly_table(offOrProp: str, commodity: str, month: str, count: int):
+        # The months are filled in once the options store has loaded
+        if month is None:
+            return no_update
+        o_or_p = 'Property_Name' if offOrProp=='Property' else offOrProp
+
+        with timed('callback.anomaly_table') as timing:
+            scan = anomalyScan(store.snapshot, o_or_p)
+            rows = scan.top(COMMODITIES[commodity], None if month == ALL_MONTHS else month, int(count))
+            records = to_records(o_or_p, rows)
+            timing.rows = len(records)
+
+        money = {"specifier": "$,.2f"}
+        amount = {"specifier": ",.2f"}
+        percent = {"specifier": "+.1%"}
+        score = {"specifier": "+.1f"}
+        columns = [{"name": o_or_p, "id": o_or_p, "type": "text"},
+                   {"name": 'Commodity', "id": 'Commodity', "type": "text"},
+                   {"name": 'Month', "id": 'Month', "type": "text"},
+                   {"name": 'Unit', "id": 'Unit', "type": "text"},
+                   {"name": 'Usage', "id": 'Usage', "type": "numeric", "format": amount},
+                   {"name": 'Spending ($)', "id": 'Spending ($)', "type": "numeric", "format": money},
+                   {"name": 'Cost per Unit ($)', "id": 'Cost per Unit ($)', "type": "numeric", "format": {"specifier": "$,.4f"}},
+                   {"name": 'Usage MoM', "id": 'Usage MoM', "type": "numeric", "format": percent},
+                   {"name": 'Usage YoY', "id": 'Usage YoY', "type": "numeric", "format": percent},
+                   {"name": 'Spending MoM', "id": 'Spending MoM', "type": "numeric", "format": percent},
+                   {"name": 'Spending YoY', "id": 'Spending YoY', "type": "numeric", "format": percent},
+                   {"name": 'Usage z', "id": 'Usage z', "type": "numeric", "format": score},
+                   {"name": 'Spending z', "id": 'Spending z', "type": "numeric", "format": score},
+                   {"name": 'Cost per Unit z', "id": 'Cost per Unit z', "type": "numeric", "format": score},
+                   {"name": 'Flags', "id": 'Flags', "type": "text"}]
+
+        title = html.H6(f'{len(records)} flagged: at least {Z_THRESHOLD:g} standard deviations from the '
+                        f'previous {WINDOW_MONTHS} months' if records else 'Nothing is flagged for this selection')
+        table = dash_table.DataTable(
+            data=records,
+            columns=columns,
+            style_cell={'textAlign': 'right', 'whiteSpace': 'normal', 'height': 'auto'},
+            style_cell_conditional=[{'if': {'column_id': c}, 'textAlign': 'left'} for c in (o_or_p, 'Flags')],
+            style_table={'overflowX': 'scroll'},
+            style_header={'fontWeight': 'bold'},
+            sort_action='native',
+            page_size=25,
+            editable=False)
+        return html.Div([title, table], style={'margin-left':'15px', 'margin-top':'15px', 'margin-right':'15px'})
+
+    return html.Div(id=ids.ANOMALIES)
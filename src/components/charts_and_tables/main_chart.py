@@ -1,55 +1,128 @@
 """ This file renders the chart that is depicted in the main tab of the
     dashboard and updates that chart based on the user's selections in the
-    dropdowns. """
+    dropdowns (the callback that calls it is in main_view.py). The chart is
+    drawn in full only when the commodity, metric, or grouping changes;
+    adding or removing offices or properties sends just the traces that were
+    added and the positions of the ones removed, as a Patch of the figure
+    already in the browser. Above a set number of traces the chart switches
+    to WebGL (scattergl), which draws hundreds of lines without stalling the
+    browser. Each line is extended by its projection for the next months
+    (see projections.py), drawn dashed. """
 
-from dash import Dash, dcc
-from dash.dependencies import Input, Output
+import os
+from dash import Patch, dcc, html
+import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
 
 import src.components.layout.ids as ids
-from src.functions import makeStringsNice, all_data_dict
+from src.callback_cache import cachedCallback
+from src.projections import selectionProjection
 
-def prepFileForPlot(df, officeOrProp, offsOrPropsToKeep):
-    df.fillna(0, inplace=True)
-    df[officeOrProp] = df[officeOrProp].apply(makeStringsNice)
-    df = df.T
-    df.columns=df.iloc[0]
-    df = df[1:]
-    df = df.loc[:, df.columns.intersection(offsOrPropsToKeep)]
-    return df
+# Number of lines (offices or properties) above which the chart is drawn with
+# WebGL, set with ENERGY_WEBGL_TRACES
+WEBGL_TRACES = int(os.environ.get('ENERGY_WEBGL_TRACES', '40'))
 
-# usageOrSpending must be lowercase
-def getPlot(g_or_e, u_or_s, officeOrProp, offsOrPropsToKeep):
+# Each office or property is drawn as two traces: its data, and its
+# projection (see projections.py) as a dashed extension
+TRACES_PER_NAME = 2
+
+# This function builds the line for one office or property. Its colour comes
+# from the office's or property's place in the full matrix, so a line keeps
+# its colour when other lines are added or removed
+def makeTrace(matrix, officeOrProp, name, webgl):
+    row = matrix.positionOf[name]
+    colors = px.colors.qualitative.Plotly
+    trace = go.Scattergl if webgl else go.Scatter
+    return trace(
+        x=matrix.labels, y=np.nan_to_num(matrix.row(name)), name=name, mode='lines',
+        legendgroup=name, line={'color': colors[row % len(colors)]},
+        hovertemplate=officeOrProp + '=' + name + '<br>index=%{x}<br>value=%{y}<extra></extra>',
+    )
 
+# This function builds the dashed projection of one office or property. It
+# starts at the last month of data so it continues the line, and shares the
+# line's colour and legend entry
+def makeProjectionTrace(matrix, projection, officeOrProp, name, webgl):
+    row = matrix.positionOf[name]
+    colors = px.colors.qualitative.Plotly
+    trace = go.Scattergl if webgl else go.Scatter
+    last = np.nan_to_num(matrix.row(name)[-1:])
+    return trace(
+        x=matrix.labels[-1:] + projection.labels, y=np.concatenate([last, projection.row(name)]),
+        name=name + ' (projected)', mode='lines', legendgroup=name, showlegend=False,
+        line={'color': colors[row % len(colors)], 'dash': 'dash'},
+        hovertemplate=officeOrProp + '=' + name + ' (projected)<br>index=%{x}<br>value=%{y}<extra></extra>',
+    )
+
+# This function returns the traces drawn for one office or property
+def makeTraces(matrix, projection, officeOrProp, name, webgl):
+    return [makeTrace(matrix, officeOrProp, name, webgl),
+            makeProjectionTrace(matrix, projection, officeOrProp, name, webgl)]
+
+# This function returns the title and axis titles of the chart
+def chartLayout(g_or_e, u_or_s, officeOrProp):
     usageUnit = 'therms' if g_or_e=='gas' else 'kWh'
     unit = '$' if u_or_s=='spending' else usageUnit
     title_ge = 'Gas' if g_or_e=='gas' else 'Electricity'
     title_us = 'Usage' if u_or_s=='usage' else 'Spending'
-    title_po = 'Property' if officeOrProp=='Property_Name' else 'Office'
-
-    df = prepFileForPlot(all_data_dict[(g_or_e, u_or_s, officeOrProp)], officeOrProp, offsOrPropsToKeep)
-    
-    fig = px.line(df, x=df.index, y=df.columns)
-    fig.update_layout(
-        title={'text': 'Cook County ' + title_ge + ' ' + title_us + ' by ' + title_po,'x': 0.5},
-        xaxis_title=None,
-        yaxis_title=u_or_s + ' (' + unit + ')',
-    )
+    title_po = '' if officeOrProp=='County' else ' by ' + ('Property' if officeOrProp=='Property_Name' else 'Office')
+    return {
+        'title': {'text': 'Cook County ' + title_ge + ' ' + title_us + title_po, 'x': 0.5},
+        'xaxis': {'title': {'text': None}},
+        'yaxis': {'title': {'text': u_or_s + ' (' + unit + ')'}},
+        'legend': {'title': {'text': officeOrProp}},
+    }
+
+# usageOrSpending must be lowercase
+def getPlot(snapshot, g_or_e, u_or_s, officeOrProp, offsOrPropsToKeep, webgl=None):
+    matrix = snapshot.selection(g_or_e, u_or_s, officeOrProp, offsOrPropsToKeep or [])
+    fitted = selectionProjection(snapshot, g_or_e, u_or_s, officeOrProp, matrix)
+    names = matrix.entities
+    if webgl is None:
+        webgl = len(names) > WEBGL_TRACES
+    fig = go.Figure([trace for name in names for trace in makeTraces(matrix, fitted, officeOrProp, name, webgl)])
+    fig.update_layout(chartLayout(g_or_e, u_or_s, officeOrProp))
     return fig
 
-def render(app: Dash):
-    @app.callback(
-        Output(ids.CHART, 'children'),
-        Input(ids.GAS_OR_ELEC, 'value'),
-        Input(ids.USAGE_OR_SPENDING, 'value'),
-        Input(ids.OFFICES_OR_PROPS, 'value'),
-        Input(ids.OFFS_PROPS_DROPDOWN, 'value'),
-    )
-    def update_main_chart(gasOrElec: str, usageOrSpending: str, offsOrProps: str, offsOrPropsToKeep: list[str]):
-        g_or_e = 'electricity' if gasOrElec=='Electricity' else 'gas'
-        u_or_s = 'usage' if usageOrSpending=='Usage' else 'spending'
-        o_or_p = 'Property_Name' if offsOrProps=='Property' else 'Office'
-
-        fig = getPlot(g_or_e, u_or_s, o_or_p, offsOrPropsToKeep)
-        fig = dcc.Graph(figure=fig)
-        return fig
\ No newline at end of file
+# Full figures are kept in the callback cache, keyed like the chart used to be
+@cachedCallback('main_chart', unordered=(4,))
+def full_chart(snapshot, g_or_e, u_or_s, o_or_p, offsOrPropsToKeep):
+    return getPlot(snapshot, g_or_e, u_or_s, o_or_p, offsOrPropsToKeep).to_plotly_json()
+
+# This function returns the chart for the selections and what it shows. If the
+# chart in the browser (described by plotted) shows the same view of the
+# data, the chart is a Patch of it
+def update_chart(snapshot, g_or_e, u_or_s, o_or_p, offsOrPropsToKeep: list[str], plotted):
+    matrix = snapshot.selection(g_or_e, u_or_s, o_or_p, offsOrPropsToKeep or [])
+    names = list(matrix.entities)
+    webgl = len(names) > WEBGL_TRACES
+    view = [snapshot.version, g_or_e, u_or_s, o_or_p]
+
+    # Draw the whole chart if a different view of the data is shown, the
+    # data was reloaded, or the chart switches between SVG and WebGL
+    if not plotted or plotted['view'] != view or plotted['webgl'] != webgl:
+        fig = full_chart(snapshot, g_or_e, u_or_s, o_or_p, offsOrPropsToKeep)
+        return fig, {'view': view, 'webgl': webgl, 'names': names}
+
+    # Otherwise remove the lines no longer selected, from the last one back so
+    # positions stay valid, and add the new ones at the end
+    current = plotted['names']
+    selected = set(names)
+    kept = [name for name in current if name in selected]
+    added = [name for name in names if name not in set(current)]
+    fitted = selectionProjection(snapshot, g_or_e, u_or_s, o_or_p, matrix.subset(added))
+    patched = Patch()
+    for i in reversed([i for i, name in enumerate(current) if name not in selected]):
+        for position in reversed(range(i * TRACES_PER_NAME, (i + 1) * TRACES_PER_NAME)):
+            del patched['data'][position]
+    for name in added:
+        for trace in makeTraces(matrix, fitted, o_or_p, name, webgl):
+            patched['data'].append(trace.to_plotly_json())
+    return patched, {'view': view, 'webgl': webgl, 'names': kept + added}
+
+def render():
+    return html.Div([
+        dcc.Graph(id=ids.MAIN_GRAPH),
+        dcc.Store(id=ids.CHART_STATE),
+    ])
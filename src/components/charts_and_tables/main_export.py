@@ -0,0 +1,42 @@
+""" This file renders the buttons under the main tab's table that download
+    the data it shows, for every month, as CSV or Parquet. The buttons submit
+    a form to /export (see export.py), which streams the file back, so a
+    download of every property never goes through a callback. The selection
+    the form sends is kept up to date in the browser from the dropdowns. """
+
+from dash import Dash, dcc, html
+from dash.dependencies import Input, Output
+import src.components.layout.ids as ids
+from src.export import PARQUET_AVAILABLE
+
+def render(app: Dash):
+
+    app.clientside_callback(
+        """
+        function(gasOrElec, usageOrSpending, offsOrProps, offsOrPropsToKeep) {
+            return JSON.stringify({
+                commodity: gasOrElec === 'Electricity' ? 'electricity' : 'gas',
+                metric: usageOrSpending === 'Usage' ? 'usage' : 'spending',
+                grouping: offsOrProps === 'Property' ? 'Property_Name' : offsOrProps,
+                names: offsOrPropsToKeep || []
+            });
+        }
+        """,
+        Output(ids.EXPORT_SELECTION, 'value'),
+        Input(ids.GAS_OR_ELEC, 'value'),
+        Input(ids.USAGE_OR_SPENDING, 'value'),
+        Input(ids.OFFICES_OR_PROPS, 'value'),
+        Input(ids.OFFS_PROPS_DROPDOWN, 'value')
+    )
+
+    formats = [('csv', 'Download CSV')] + ([('parquet', 'Download Parquet')] if PARQUET_AVAILABLE else [])
+    return html.Form(
+        action=app.get_relative_path('/export'),
+        method='post',
+        children=[dcc.Input(id=ids.EXPORT_SELECTION, type='hidden', name='selection')] + [
+            html.Button(label, name='format', value=value, type='submit', className="dropdown_button",
+                        style={'margin-right': '10px'})
+            for value, label in formats
+        ],
+        style={'margin-top': '10px', 'margin-bottom': '15px'}
+    )
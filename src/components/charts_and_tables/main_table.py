@@ -1,54 +1,53 @@
 """ This file renders the table that is depicted in the main tab of the
-    dashboard and updates that table based on the user's selections in the
-    dropdowns. """
+    dashboard and builds the page of it to show for the user's selections in
+    the dropdowns (the callback that calls it is in main_view.py). The table
+    is paged, sorted, and filtered on the server (see table_query.py), so
+    only the page being shown is sent to the browser. """
 
-from dash import Dash, dash_table
-from dash.dependencies import Input, Output
+from dash import dash_table
 import src.components.layout.ids as ids
-import src.functions as fcns
+from src.callback_cache import cachedCallback
+from src.table_query import queryTable, tableSelection
 
-def render(app: Dash):
-    @app.callback(
-        Output(ids.TABLE, 'children'),
-        Input(ids.OFFS_PROPS_DROPDOWN, 'value'),
-        Input(ids.GAS_OR_ELEC, 'value'),
-        Input(ids.USAGE_OR_SPENDING, 'value'),
-        Input(ids.OFFICES_OR_PROPS, 'value')
-    )
-    def update_table(offsOrPropsToKeep: list[str], gasOrElec:str, usageOrSpending: str, offsOrProps):
-        g_or_e = 'electricity' if gasOrElec=='Electricity' else 'gas'
-        u_or_s = 'usage' if usageOrSpending=='Usage' else 'spending'
-        o_or_p = 'Property_Name' if offsOrProps=='Property' else 'Office'
+PAGE_SIZE = 17
 
-        df = fcns.all_data_dict[(g_or_e, u_or_s, o_or_p)]
+# This function returns the table's data, columns, tooltips, page count, and
+# current page for the selections
+@cachedCallback('main_table', unordered=(1,))
+def update_table(snapshot, offsOrPropsToKeep: list[str], g_or_e: str, u_or_s: str, o_or_p: str,
+                 page_current, page_size, sort_by, filter_query):
+    matrix, values = tableSelection(snapshot, g_or_e, u_or_s, o_or_p, offsOrPropsToKeep or [])
+    page = queryTable(matrix, values, o_or_p, offsOrPropsToKeep, page_current, page_size or PAGE_SIZE,
+                      sort_by, filter_query)
 
-        df[o_or_p] = df[o_or_p].apply(fcns.makeStringsNice)
-        df = df.set_index(o_or_p)
-        df = df.astype(float).round(2).reset_index()
-        df.fillna(0, inplace=True)
-        filtered_df = df[df[o_or_p].isin(offsOrPropsToKeep)]
+    columns = [{'name': o_or_p, 'id': o_or_p, 'type': 'text'}]
+    columns += [{'name': label, 'id': label, 'type': 'numeric'} for label in matrix.labels]
+    return page['records'], columns, page['tooltips'], page['pageCount'], page['page']
 
-        table = dash_table.DataTable(
-            data=filtered_df.to_dict('records'),
-            style_cell={
-                'height': 'auto',
-                'minWidth': '100px', 'width': '100px', 'maxWidth': '150px',
-                'whiteSpace': 'normal',
-                'textAlign': 'right',
-                'textOverflow': 'ellipsis',
-            },
-            style_cell_conditional=[{
-                'if': {'column_id': 'Office'}, 'textAlign': 'left', 'minWidth': '150px'},
-                {
-                'if': {'column_id': 'Property_Name'}, 'textAlign': 'left', 'minWidth': '150px'}
-            ],
-            style_table={'overflowY': 'scroll', 'overflowX': 'scroll'},
-            page_size=17,
-            style_header={'fontWeight': 'bold'},
-            editable=False,
-            sort_action='native',
-            tooltip_data=[{o_or_p: {'value': str(value), 'type': 'markdown'}
-                        for o_or_p, value in row.items()
-                        } for row in df.to_dict('records')
-        ])
-        return table
+def render():
+    return dash_table.DataTable(
+        id=ids.MAIN_DATATABLE,
+        style_cell={
+            'height': 'auto',
+            'minWidth': '100px', 'width': '100px', 'maxWidth': '150px',
+            'whiteSpace': 'normal',
+            'textAlign': 'right',
+            'textOverflow': 'ellipsis',
+        },
+        style_cell_conditional=[{
+            'if': {'column_id': 'Office'}, 'textAlign': 'left', 'minWidth': '150px'},
+            {
+            'if': {'column_id': 'Property_Name'}, 'textAlign': 'left', 'minWidth': '150px'},
+            {
+            'if': {'column_id': 'County'}, 'textAlign': 'left', 'minWidth': '150px'}
+        ],
+        style_table={'overflowY': 'scroll', 'overflowX': 'scroll'},
+        page_current=0,
+        page_size=PAGE_SIZE,
+        page_action='custom',
+        sort_action='custom',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
+        style_header={'fontWeight': 'bold'},
+        editable=False)
@@ -0,0 +1,55 @@
+""" This file holds the one server callback behind the main tab. A change to
+    the dropdowns updates the chart and the table in a single request, so a
+    selection is only ever looked up once; paging, sorting, or filtering the
+    table leaves the chart as it is. """
+
+from dash import Dash, ctx, no_update
+from dash.dependencies import Input, Output, State
+import src.components.layout.ids as ids
+from src.components.charts_and_tables.main_chart import update_chart
+from src.components.charts_and_tables.main_table import update_table
+from src.metrics import timed
+from src.store import store
+
+# Inputs that only change what the table shows
+TABLE_ONLY = {ids.MAIN_DATATABLE}
+
+def render(app: Dash):
+    @app.callback(
+        Output(ids.MAIN_GRAPH, 'figure'),
+        Output(ids.CHART_STATE, 'data'),
+        Output(ids.MAIN_DATATABLE, 'data'),
+        Output(ids.MAIN_DATATABLE, 'columns'),
+        Output(ids.MAIN_DATATABLE, 'tooltip_data'),
+        Output(ids.MAIN_DATATABLE, 'page_count'),
+        Output(ids.MAIN_DATATABLE, 'page_current'),
+        Input(ids.GAS_OR_ELEC, 'value'),
+        Input(ids.USAGE_OR_SPENDING, 'value'),
+        Input(ids.OFFICES_OR_PROPS, 'value'),
+        Input(ids.OFFS_PROPS_DROPDOWN, 'value'),
+        Input(ids.MAIN_DATATABLE, 'page_current'),
+        Input(ids.MAIN_DATATABLE, 'page_size'),
+        Input(ids.MAIN_DATATABLE, 'sort_by'),
+        Input(ids.MAIN_DATATABLE, 'filter_query'),
+        State(ids.CHART_STATE, 'data'),
+    )
+    def update_main_view(gasOrElec: str, usageOrSpending: str, offsOrProps: str, offsOrPropsToKeep: list[str],
+                         page_current, page_size, sort_by, filter_query, plotted):
+        g_or_e = 'electricity' if gasOrElec=='Electricity' else 'gas'
+        u_or_s = 'usage' if usageOrSpending=='Usage' else 'spending'
+        o_or_p = 'Property_Name' if offsOrProps=='Property' else offsOrProps
+        # The chart and the table are read from one snapshot, so they show the
+        # same version of the data even if a reload happens in between
+        snapshot = store.snapshot
+
+        if ctx.triggered_id in TABLE_ONLY:
+            chart = (no_update, no_update)
+        else:
+            with timed('callback.main_chart', rows=len(offsOrPropsToKeep or [])):
+                chart = update_chart(snapshot, g_or_e, u_or_s, o_or_p, offsOrPropsToKeep, plotted)
+            # A new selection starts the table from its first page
+            page_current = 0
+        with timed('callback.main_table') as timing:
+            table = update_table(snapshot, offsOrPropsToKeep, g_or_e, u_or_s, o_or_p, page_current, page_size, sort_by, filter_query)
+            timing.rows = len(table[0])
+        return chart + table
@@ -0,0 +1,59 @@
+""" This file renders the dropdowns of the anomalies tab, which let the user
+    choose whether to look for anomalies among properties, offices, or the
+    county, in electricity, gas, or both, in which month (or the worst month
+    of each), and how many of the most anomalous to show. """
+
+from dash import Dash, html, dcc
+from dash.dependencies import Input, Output, State
+import dash_bootstrap_components as dbc
+import src.components.layout.ids as ids
+
+# Value of the month dropdown that shows each office's or property's worst
+# month
+ALL_MONTHS = 'All'
+
+def render(app: Dash):
+
+    # The months come from the options store, so this runs in the browser.
+    # The newest month is chosen until the user picks another
+    app.clientside_callback(
+        """
+        function(options, month) {
+            if (!options) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            const dates = options.dates.slice().reverse();
+            const value = (month && (month === '%s' || dates.includes(month))) ? month : dates[0];
+            return [value, [{label: 'All months (worst of each)', value: '%s'}].concat(
+                dates.map(val => ({label: val, value: val})))];
+        }
+        """ % (ALL_MONTHS, ALL_MONTHS),
+        Output(ids.ANOMALY_MONTH, "value"),
+        Output(ids.ANOMALY_MONTH, "options"),
+        Input(ids.OPTIONS_STORE, "data"),
+        State(ids.ANOMALY_MONTH, "value")
+    )
+
+    return dbc.Row(
+        [
+            dbc.Col(html.Div(
+                children=[
+                    html.H6('Choose category: Properties, Offices, or County'),
+                    dcc.Dropdown(['Property', 'Office', 'County'], 'Property', id=ids.ANOMALY_GROUPING, clearable=False, searchable=False)
+                ]), width=3),
+            dbc.Col(html.Div(
+                children=[
+                    html.H6('Choose category: Gas, Electricity, or Both'),
+                    dcc.Dropdown(['Both', 'Electricity', 'Gas'], 'Both', id=ids.ANOMALY_COMMODITY, clearable=False, searchable=False)
+                ]), width=3),
+            dbc.Col(html.Div(
+                children=[
+                    html.H6('Choose month'),
+                    dcc.Dropdown(id=ids.ANOMALY_MONTH, clearable=False)
+                ]), width=3),
+            dbc.Col(html.Div(
+                children=[
+                    html.H6('Number of anomalies to show'),
+                    dcc.Dropdown([10, 25, 50, 100], 25, id=ids.ANOMALY_COUNT, clearable=False, searchable=False)
+                ]), width=3),
+        ], justify="evenly", style = {'margin-left':'15px', 'margin-top':'15px', 'margin-right':'15px'})
@@ -5,27 +5,32 @@
 
 from dash import Dash, html, dcc
 from dash.dependencies import Input, Output
-from src.functions import all_data_dict
 import src.components.layout.ids as ids
 
-e_s_p = all_data_dict['electricity', 'usage', 'Property_Name']
-dates = e_s_p.columns.drop('Property_Name')
-    
 def render(app: Dash):
 
-    @app.callback(
+    # The months are only known once the data has loaded, so the options are
+    # filled in from the options store by the same (clientside) callback that
+    # selects all of them
+    app.clientside_callback(
+        """
+        function(nClicks, options) {
+            if (!options) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            return [options.dates, options.dates];
+        }
+        """,
         Output(ids.DATES_DROPDOWN_AVE, "value"),
-        Input(ids.DATES_SELECT_ALL, "n_clicks")
+        Output(ids.DATES_DROPDOWN_AVE, "options"),
+        Input(ids.DATES_SELECT_ALL, "n_clicks"),
+        Input(ids.OPTIONS_STORE, "data")
     )
 
-    def select_all_dates(_: int):
-        return dates
-
     return html.Div(
         children=[
             html.H6('Months Selected for Average'),
             dcc.Dropdown(
-                options=dates,
                 id=ids.DATES_DROPDOWN_AVE,
                 multi=True,
             ),
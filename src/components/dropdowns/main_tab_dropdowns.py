@@ -1,27 +1,32 @@
 """ This file renders the dropdowns that allows the user to choose whether they
     wish to see electricity or gas data and usage or spending data, whether to
-    group by offices or properties, and which of these offices or properties to
-    include. """
+    group by offices or properties or show the county as a whole, and which of
+    these offices or properties to include. """
 
 from dash import Dash, html, dcc
 from dash.dependencies import Input, Output
 import src.components.layout.ids as ids
-from src.functions import properties, offices
 
 def render(app: Dash):
 
-    @app.callback(
+    # Create a button to select all options of the dropdown. The lists come
+    # from the options store, so this runs in the browser
+    app.clientside_callback(
+        """
+        function(nClicks, offsOrProps, options) {
+            if (!options) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            const value = {Property: options.properties, Office: options.offices, County: options.counties}[offsOrProps];
+            return [value, value.map(val => ({label: val, value: val}))];
+        }
+        """,
         Output(ids.OFFS_PROPS_DROPDOWN, "value"),
         Output(ids.OFFS_PROPS_DROPDOWN, "options"),
         Input(ids.SELECT_ALL, "n_clicks"),
-        Input(ids.OFFICES_OR_PROPS, "value")
+        Input(ids.OFFICES_OR_PROPS, "value"),
+        Input(ids.OPTIONS_STORE, "data")
     )
-    
-    # Create a button to select all options of the dropdown
-    def select_all_offices(_: int, offsOrProps):
-        value = properties if offsOrProps=="Property" else offices
-        options = [{'label': val, 'value': val} for val in value]
-        return value, options
 
     return html.Div(
         children=[
@@ -39,8 +44,8 @@ def render(app: Dash):
             ),
             html.Div(
                 children=[
-                    html.H6('Choose category: Properties or Offices'),
-                    dcc.Dropdown(['Property', 'Office'], 'Property', id=ids.OFFICES_OR_PROPS, clearable=False, searchable=False)
+                    html.H6('Choose category: Properties, Offices, or County'),
+                    dcc.Dropdown(['Property', 'Office', 'County'], 'Property', id=ids.OFFICES_OR_PROPS, clearable=False, searchable=False)
                 ], style = {'margin-left':'15px', 'margin-top':'15px', 'margin-right':'15px'}
             ),
             html.Div(
@@ -0,0 +1,35 @@
+""" This file renders the store that holds the lists of properties, offices,
+    the county, and months the dropdowns choose from. It is filled once, when the page
+    loads, and the dropdowns read their options and "Select All" values from
+    it in the browser (clientside callbacks) instead of asking the server. A
+    page reload picks up lists changed by a reload of the data. """
+
+from dash import Dash, dcc, html
+from dash.dependencies import Input, Output
+import src.components.layout.ids as ids
+from src.facts import COUNTY
+from src.metrics import timed
+from src.store import store
+
+def render(app: Dash):
+
+    @app.callback(
+        Output(ids.OPTIONS_STORE, 'data'),
+        Input(ids.URL, 'pathname')
+    )
+    def load_options(_: str):
+        with timed('callback.options') as timing:
+            snapshot = store.snapshot
+            timing.rows = len(snapshot.properties) + len(snapshot.offices) + len(snapshot.dates)
+        return {
+            'version': snapshot.version,
+            'properties': snapshot.properties,
+            'offices': snapshot.offices,
+            'counties': [COUNTY],
+            'dates': snapshot.dates,
+        }
+
+    return html.Div([
+        dcc.Location(id=ids.URL),
+        dcc.Store(id=ids.OPTIONS_STORE),
+    ])
@@ -1,7 +1,11 @@
 # IDs for the main tab
 OFFS_PROPS_DROPDOWN = "offices_or_properties_dropdown"
 TABLE = "table"
+MAIN_DATATABLE = "main_datatable"
 CHART = "chart"
+MAIN_GRAPH = "main_graph"
+CHART_STATE = "chart_state"
+EXPORT_SELECTION = "export_selection"
 SELECT_ALL = "select_all"
 OFFICES_OR_PROPS = "offices_or_props"
 GAS_OR_ELEC = "gas_or_elec"
@@ -15,3 +19,14 @@ DATES_DROPDOWN_AVE = "dates_dropdown_ave"
 DATES_SELECT_ALL = "dates_select_all"
 OP_DROPDOWN_CONTAINER = "office_or_property_ave_container"
 AVE_OFFICE_SELECTED_TITLE = "ave_selected_title"
+
+# IDs for the anomalies tab
+ANOMALIES = "anomalies"
+ANOMALY_GROUPING = "anomaly_grouping"
+ANOMALY_COMMODITY = "anomaly_commodity"
+ANOMALY_MONTH = "anomaly_month"
+ANOMALY_COUNT = "anomaly_count"
+
+# IDs shared by every tab
+URL = "url"
+OPTIONS_STORE = "options_store"
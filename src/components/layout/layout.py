@@ -2,12 +2,12 @@
 
 from dash import Dash, html, dcc
 import dash_bootstrap_components as dbc
-from src.components.dropdowns import ave_tab_months_dropdown, ave_tab_options_dropdown
-from src.components.charts_and_tables import main_chart, main_table
+from src.components.dropdowns import anomaly_tab_dropdowns, ave_tab_months_dropdown, ave_tab_options_dropdown, options_store
+from src.components.charts_and_tables import main_chart, main_export, main_table, main_view
 
 from src.components.layout import ids
 from src.components.dropdowns import main_tab_dropdowns
-from src.components.charts_and_tables import ave_table
+from src.components.charts_and_tables import anomaly_table, ave_table
 
 def create_layout(app: Dash):
     """ Create layout to be used in main.py file """
@@ -16,6 +16,8 @@ def create_layout(app: Dash):
             # App Title
             html.H1(app.title, style={'textAlign': 'center', 'margin-top':'15px', 'color':'blue'}),
             html.Hr(),
+            options_store.render(app),
+            main_view.render(app),
             dcc.Tabs([
                 # Main Tab
                 dcc.Tab(label='Main', children=[
@@ -33,8 +35,9 @@ def create_layout(app: Dash):
                                     ),
                                     # Chart and table
                                     dbc.Col([
-                                        html.Div(children=[main_chart.render(app)], id=ids.CHART),
-                                        html.Div(children=[main_table.render(app)], id=ids.TABLE, style={'margin-right':'25px'}),
+                                        html.Div(children=[main_chart.render()], id=ids.CHART),
+                                        html.Div(children=[main_table.render()], id=ids.TABLE, style={'margin-right':'25px'}),
+                                        main_export.render(app),
                                     ], width=9)
                                 ], justify="evenly", style = {'margin-left':'15px', 'margin-right':'15px'}
                             )
@@ -53,8 +56,8 @@ def create_layout(app: Dash):
                                 dbc.Col([
                                     html.Div(
                                         children=[
-                                            html.H6('Choose category: Properties or Offices'),
-                                            dcc.Dropdown(['Property', 'Office'], 'Property', id=ids.O_OR_P_AVE, clearable=False, searchable=False)
+                                            html.H6('Choose category: Properties, Offices, or County'),
+                                            dcc.Dropdown(['Property', 'Office', 'County'], 'Property', id=ids.O_OR_P_AVE, clearable=False, searchable=False)
                                         ], style={'margin-bottom': '15px'}),
                                     html.Div(className="dropdown_container", children=[ave_tab_options_dropdown.render(app)])
                                     ], width=6
@@ -66,6 +69,20 @@ def create_layout(app: Dash):
                             html.Hr(),
                         ],
                     )
+                ]),
+                # Anomalies Tab
+                dcc.Tab(label='Anomalies', children=[
+                    html.Div(
+                        className="app-div",
+                        children=[
+                            html.Hr(),
+                            # Dropdowns
+                            anomaly_tab_dropdowns.render(app),
+                            # Table
+                            anomaly_table.render(app),
+                            html.Hr(),
+                        ],
+                    )
                 ])
             ])
         ])
\ No newline at end of file
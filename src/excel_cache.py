@@ -0,0 +1,237 @@
+""" This file contains a cache layer for the Excel workbooks that are read in
+    functions.py. Parsing the .xlsx files is by far the slowest part of
+    starting the dashboard, so every sheet of a parsed workbook is written to
+    a Parquet file in the cache folder, together with a small JSON entry that
+    records the path, size, modification time, and content hash of the source
+    workbook. On later starts the sheets are loaded from the cache, and only
+    workbooks that have changed are parsed again. The cache can be cleared or
+    rebuilt from the command line:
+
+        python -m src.excel_cache clear
+        python -m src.excel_cache rebuild """
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import pandas as pd
+from src.metrics import timed
+
+# Parquet files are written with pyarrow; without it the cache is skipped and
+# the workbooks are read straight from Excel every time
+try:
+    import pyarrow  # noqa: F401
+    CACHE_AVAILABLE = True
+except ImportError:
+    CACHE_AVAILABLE = False
+
+# Folder that holds the cached sheets, can be moved with ENERGY_CACHE_DIR
+CACHE_DIR = os.environ.get('ENERGY_CACHE_DIR', './data/.cache')
+
+# Bump this when the way sheets are stored changes so old entries are ignored
+CACHE_FORMAT = 1
+
+# This function computes the SHA-256 hash of a file's contents
+# INPUT: Path to a file
+# OUTPUT: Hex digest string
+def hashFile(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Each source workbook gets its own entry file, named after its absolute path,
+# so that workbooks parsed in different processes never write the same file.
+# A workbook read in part (e.g. only its month sheets, see excel_stream.py)
+# is cached separately from a full read, under the name of that variant
+def _entryPath(path, variant=None):
+    name = os.path.abspath(path) if variant is None else f'{os.path.abspath(path)}#{variant}'
+    key = hashlib.sha1(name.encode()).hexdigest()
+    return os.path.join(CACHE_DIR, key + '.json')
+
+def _readEntryFile(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# This function lists the cache's entries, whatever their format
+# OUTPUT: Generator of (entry file path, entry)
+def _entries():
+    try:
+        filenames = [f for f in os.listdir(CACHE_DIR) if f.endswith('.json')]
+    except OSError:
+        return
+    for filename in filenames:
+        entry = _readEntryFile(os.path.join(CACHE_DIR, filename))
+        if entry is not None:
+            yield os.path.join(CACHE_DIR, filename), entry
+
+def _readEntry(path, variant=None):
+    entry = _readEntryFile(_entryPath(path, variant))
+    if entry is None or entry.get('format') != CACHE_FORMAT:
+        return None
+    return entry
+
+# Write to a temporary file first so a crash never leaves half an entry behind
+def _writeJson(filename, content):
+    tmp = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(content, f)
+    os.replace(tmp, filename)
+
+# Parquet needs string column names and one type per column, while Excel
+# columns often mix numbers and text (e.g. 'N/A' in a kWh column). Mixed
+# columns are stored as text; functions.py already coerces the numeric ones
+# with pd.to_numeric
+def _makeArrowSafe(df):
+    df = df.copy()
+    df.columns = [str(c) for c in df.columns]
+    for column in df.columns[df.dtypes == object]:
+        kind = pd.api.types.infer_dtype(df[column], skipna=True)
+        if kind not in ('string', 'empty', 'floating', 'integer', 'boolean', 'datetime', 'date'):
+            values = df[column]
+            df[column] = values.where(values.isna(), values.astype(str))
+    return df
+
+def _sheetsFolder(entry):
+    variant = entry.get('variant')
+    return os.path.join(CACHE_DIR, entry['sha256'] if variant is None else f"{entry['sha256']}-{variant}")
+
+def _loadSheets(entry):
+    folder = _sheetsFolder(entry)
+    return {name: pd.read_parquet(os.path.join(folder, f'{i}.parquet'))
+            for i, name in enumerate(entry['sheets'])}
+
+def _storeSheets(path, sheets, stat, digest, variant=None):
+    entry = {
+        'format': CACHE_FORMAT,
+        'path': os.path.abspath(path),
+        'variant': variant,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': digest,
+        'sheets': list(sheets.keys()),
+    }
+    folder = _sheetsFolder(entry)
+    os.makedirs(folder, exist_ok=True)
+    for i, df in enumerate(sheets.values()):
+        tmp = os.path.join(folder, f'{i}.parquet.{os.getpid()}.tmp')
+        _makeArrowSafe(df).to_parquet(tmp)
+        os.replace(tmp, os.path.join(folder, f'{i}.parquet'))
+    previous = _readEntryFile(_entryPath(path, variant))
+    _writeJson(_entryPath(path, variant), entry)
+    # The sheets of the workbook's previous contents are no longer used,
+    # unless another workbook has the same contents
+    if previous is not None and previous.get('sha256'):
+        stale = _sheetsFolder(previous)
+        if stale != folder and all(_sheetsFolder(other) != stale for _, other in _entries()):
+            shutil.rmtree(stale, ignore_errors=True)
+
+# This function reads a whole workbook, like pd.read_excel(path, sheet_name=None)
+def _readWholeWorkbook(path):
+    return pd.read_excel(path, sheet_name=None)
+
+# This function is a drop-in replacement for pd.read_excel(path, sheet_name=None).
+# A workbook whose size and modification time match its cache entry is loaded
+# from the cache straight away. If only the modification time changed, the
+# content hash decides whether the workbook has to be parsed again. To cache
+# only part of a workbook, pass a reader that returns those sheets and a
+# variant naming what it reads
+# INPUT: Path to an Excel file; whether to ignore the cache and reparse;
+#        function reading the path into a dictionary of dataframes; name of
+#        the variant
+# OUTPUT: Dictionary mapping sheet names to dataframes
+def readExcelCached(path, rebuild=False, reader=_readWholeWorkbook, variant=None):
+    if not CACHE_AVAILABLE:
+        with timed('ingest.excel_parse') as timing:
+            sheets = reader(path)
+            timing.rows = sum(len(df) for df in sheets.values())
+        return sheets
+
+    stat = os.stat(path)
+    entry = None if rebuild else _readEntry(path, variant)
+    digest = None
+    if entry is not None:
+        if entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            digest = hashFile(path)
+            if digest != entry['sha256']:
+                entry = None
+            else:
+                entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                _writeJson(_entryPath(path, variant), entry)
+        if entry is not None:
+            try:
+                with timed('ingest.excel_cache_load') as timing:
+                    sheets = _loadSheets(entry)
+                    timing.rows = sum(len(df) for df in sheets.values())
+                return sheets
+            except (OSError, ValueError):
+                entry = None
+
+    with timed('ingest.excel_parse') as timing:
+        sheets = reader(path)
+        timing.rows = sum(len(df) for df in sheets.values())
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _storeSheets(path, sheets, stat, digest or hashFile(path), variant)
+    except (OSError, ValueError, TypeError) as e:
+        print(f'Could not cache {path}: {e}', file=sys.stderr)
+    return sheets
+
+# This function tells whether a workbook can be loaded from the cache without
+# parsing it, judging only by its size and modification time
+def isCached(path, variant=None):
+    if not CACHE_AVAILABLE:
+        return False
+    entry = _readEntry(path, variant)
+    if entry is None:
+        return False
+    stat = os.stat(path)
+    return entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+
+# This function removes cached sheets. With a path only that workbook's
+# entries (of every variant) are removed, otherwise the whole cache folder is
+# deleted
+def clearCache(path=None):
+    if path is None:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+        return
+    for filename, entry in list(_entries()):
+        if entry.get('path') == os.path.abspath(path):
+            os.remove(filename)
+            shutil.rmtree(_sheetsFolder(entry), ignore_errors=True)
+
+# This function reparses the workbooks the dashboard loads (see loader.py)
+# and the propertyNamesAndOffices file, and stores fresh copies in the cache,
+# read the same way the dashboard reads them
+# INPUT: Data folder; propertyNamesAndOffices file; fiscal years to load
+# OUTPUT: List of the paths cached
+def rebuildCache(dataDir=None, officesFile=None, historyYears=None):
+    # loader.py and functions.py read through this file, so they are imported
+    # here rather than at the top
+    from src.functions import loadPropNamesAndOffices
+    from src.loader import DATA_DIR, HISTORY_YEARS, OFFICES_FILE, discoverWorkbooks, neededWorkbooks, parseWorkbooks
+    dataDir = DATA_DIR if dataDir is None else dataDir
+    officesFile = OFFICES_FILE if officesFile is None else officesFile
+    historyYears = HISTORY_YEARS if historyYears is None else historyYears
+
+    clearCache()
+    workbooks = neededWorkbooks(discoverWorkbooks(dataDir), historyYears)
+    parseWorkbooks(workbooks, rebuild=True)
+    loadPropNamesAndOffices(officesFile)
+    return [w.path for w in workbooks] + [officesFile]
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'rebuild'
+    if command == 'clear':
+        clearCache()
+        print('Cleared ' + CACHE_DIR)
+    elif command == 'rebuild':
+        for p in rebuildCache():
+            print('Cached ' + p)
+    else:
+        sys.exit('usage: python -m src.excel_cache [clear|rebuild]')
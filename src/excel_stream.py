@@ -0,0 +1,110 @@
+""" This file reads just the part of a utility workbook the dashboard uses.
+    Instead of loading every sheet and column with pd.read_excel, it lists
+    the sheet names first, keeps the ones asked for (loader.py asks for the
+    'YYYY-Mon' month sheets of the workbook's fiscal year), and streams only
+    the Property_Name, Service_Address, unit (kWh or therms), and
+    Total_Amount columns of those sheets, parsing names as text and amounts
+    as floats as it goes. Memory and time then grow with the data that is
+    used, not with the size of the workbook.
+
+    Rows are streamed with openpyxl in read-only mode, or with
+    python-calamine (a Rust reader, several times faster) when it is
+    installed. ENERGY_EXCEL_ENGINE picks one: 'auto' (the default, calamine
+    if available), 'calamine', or 'openpyxl'. The sheets come out in the
+    same shape cleanMonthSheet in functions.py expects from a full read. """
+
+import math
+import os
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from src.metrics import timed
+
+try:
+    from python_calamine import CalamineWorkbook
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
+ENGINE = os.environ.get('ENERGY_EXCEL_ENGINE', 'auto')
+
+# Text that pd.read_excel reads as a missing value, so both readers agree
+NA_STRINGS = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+              '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+
+# Columns read from each month sheet, after spaces in headers are replaced by
+# underscores; the unit column is added per commodity
+TEXT_COLUMNS = ['Property_Name', 'Service_Address']
+AMOUNT_COLUMNS = ['Total_Amount']
+
+def _engine():
+    if ENGINE == 'calamine' or (ENGINE == 'auto' and CALAMINE_AVAILABLE):
+        return 'calamine'
+    return 'openpyxl'
+
+# Cells are parsed as they are read. Text cells in the pandas missing-value
+# list are missing; whole-number floats are read as ints, as pd.read_excel does
+def _text(value):
+    if value is None or (isinstance(value, str) and value in NA_STRINGS):
+        return None
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if value.is_integer():
+            value = int(value)
+    return str(value)
+
+def _amount(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return np.nan
+    return np.nan
+
+# This function turns the rows of one sheet, header first, into a dataframe
+# of the wanted columns. Columns missing from the sheet come out empty
+def _sheetFrame(rows, unitColumn):
+    rows = iter(rows)
+    header = next(rows, None) or []
+    header = [str(c).replace(' ', '_') if c is not None else '' for c in header]
+    parsers = {c: _text for c in TEXT_COLUMNS}
+    parsers.update({c: _amount for c in [unitColumn] + AMOUNT_COLUMNS})
+    positions = {c: header.index(c) for c in parsers if c in header}
+
+    columns = {c: list() for c in parsers}
+    for row in rows:
+        for column, parse in parsers.items():
+            position = positions.get(column)
+            value = row[position] if position is not None and position < len(row) else None
+            columns[column].append(parse(value))
+    df = pd.DataFrame({c: pd.Series(values, dtype=object if parsers[c] is _text else float)
+                       for c, values in columns.items()})
+    # Rows that are empty in every wanted column are trailing formatting
+    return df.dropna(how='all').reset_index(drop=True)
+
+# This function reads some sheets of a workbook, streaming only the columns
+# the dashboard uses
+# INPUT: Path to the workbook; unit column ('kWh' or 'therms'); function
+#        telling from a sheet's name whether to read it
+# OUTPUT: Dictionary mapping each sheet read to a dataframe with the
+#         Property_Name, Service_Address, unit, and Total_Amount columns
+def readSheetColumns(path, unitColumn, keep=lambda sheet: True):
+    with timed('ingest.excel_stream') as timing:
+        sheets = dict()
+        if _engine() == 'calamine':
+            workbook = CalamineWorkbook.from_path(path)
+            for sheet in filter(keep, workbook.sheet_names):
+                rows = workbook.get_sheet_by_name(sheet).to_python(skip_empty_area=False)
+                sheets[sheet] = _sheetFrame(rows, unitColumn)
+        else:
+            workbook = load_workbook(path, read_only=True, data_only=True)
+            try:
+                for sheet in filter(keep, workbook.sheetnames):
+                    sheets[sheet] = _sheetFrame(workbook[sheet].iter_rows(values_only=True), unitColumn)
+            finally:
+                workbook.close()
+        timing.rows = sum(len(df) for df in sheets.values())
+    return sheets
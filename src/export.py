@@ -0,0 +1,150 @@
+""" This file serves downloads of the data at /export. A download is one
+    commodity, metric, and grouping, for any set of offices or properties and
+    months, laid out like the main tab's table: one row per office or
+    property and one column per month. The rows are read through the
+    snapshot's backend a chunk at a time (ENERGY_EXPORT_CHUNK_ROWS, default
+    1000) and written straight from the arrays, as CSV by pandas' writer or
+    as one Parquet row group per chunk, so the response streams out while
+    it is being built and an extract of every property never sits in
+    memory in full. The selection is sent as JSON in the 'selection' field
+    of a form POST (which the main tab's download buttons use) or of a GET
+    query string:
+
+        /export?format=csv&selection={"commodity": "gas", "metric": "usage",
+            "grouping": "Property_Name", "names": [...], "months": [...]}
+
+    names and months are optional and default to every office or property
+    and every month. """
+
+import io
+import json
+import os
+import flask
+import numpy as np
+import pandas as pd
+from src.facts import COMMODITY_UNITS, GROUPINGS, METRIC_COLUMNS
+from src.metrics import timed
+from src.store import store
+
+# Parquet files are written with pyarrow; without it only CSV is offered
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Number of offices or properties read and written at a time
+CHUNK_ROWS = int(os.environ.get('ENERGY_EXPORT_CHUNK_ROWS', '1000'))
+
+FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+# A file object that keeps what is written to it until it is drained, so a
+# Parquet file can be sent a row group at a time
+class _Pending(io.RawIOBase):
+    def __init__(self):
+        self.chunks = list()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+# This function reads and checks a selection sent to /export, aborting the
+# request with 400 if it cannot be served
+# OUTPUT: Dictionary with the commodity, metric, grouping, names (or None for
+#         all), and months (or None for all)
+def parseSelection(values):
+    try:
+        selection = json.loads(values.get('selection') or '{}')
+    except ValueError:
+        flask.abort(400, 'selection is not valid JSON')
+    if not isinstance(selection, dict):
+        flask.abort(400, 'selection must be a JSON object')
+    checks = [('commodity', COMMODITY_UNITS), ('metric', METRIC_COLUMNS), ('grouping', GROUPINGS)]
+    for field, allowed in checks:
+        if selection.get(field) not in allowed:
+            flask.abort(400, f"{field} must be one of {', '.join(allowed)}")
+    for field in ('names', 'months'):
+        value = selection.get(field)
+        if value is not None and not (isinstance(value, list) and all(isinstance(v, str) for v in value)):
+            flask.abort(400, f'{field} must be a list of strings')
+    return {field: selection.get(field) for field in ('commodity', 'metric', 'grouping', 'names', 'months')}
+
+# This function yields the selected rows a chunk at a time
+# INPUT: Snapshot; selection from parseSelection
+# OUTPUT: Generator of (list of names, array of their values for the selected
+#         months, month labels)
+def selectedChunks(snapshot, selection):
+    commodity, metric, grouping = selection['commodity'], selection['metric'], selection['grouping']
+    names = selection['names']
+    if names is None:
+        names = snapshot.names(commodity, grouping)
+    names = sorted(set(names))
+    # One chunk is read even for an empty selection, so the file has a header
+    for start in range(0, max(len(names), 1), CHUNK_ROWS):
+        chunk = snapshot.selection(commodity, metric, grouping, names[start:start + CHUNK_ROWS])
+        columns = np.arange(len(chunk.labels))
+        if selection['months'] is not None:
+            wanted = set(selection['months'])
+            columns = np.array([i for i, label in enumerate(chunk.labels) if label in wanted], dtype=np.intp)
+        yield list(chunk.entities), chunk.values[:, columns], [chunk.labels[i] for i in columns]
+
+# This function writes the chunks as CSV, with the header before the first
+# OUTPUT: Generator of bytes
+def csvChunks(chunks, grouping):
+    for i, (names, values, labels) in enumerate(chunks):
+        frame = pd.DataFrame(values, index=pd.Index(names, name=grouping), columns=labels)
+        yield frame.to_csv(header=(i == 0)).encode()
+
+# This function writes the chunks as a Parquet file, one row group per chunk
+# OUTPUT: Generator of bytes
+def parquetChunks(chunks, grouping):
+    sink = _Pending()
+    writer = None
+    for names, values, labels in chunks:
+        table = pa.table([pa.array(names, pa.string())] + [pa.array(values[:, i]) for i in range(len(labels))],
+                         names=[grouping] + labels)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+# Counts the rows of the chunks passing through into timing
+def _counted(chunks, timing):
+    for chunk in chunks:
+        timing.rows += len(chunk[0])
+        yield chunk
+
+# This function adds /export to the Flask server behind a Dash app
+def registerExport(server):
+    @server.route('/export', methods=['GET', 'POST'])
+    def export():
+        fileFormat = flask.request.values.get('format', 'csv')
+        if fileFormat not in FORMATS or (fileFormat == 'parquet' and not PARQUET_AVAILABLE):
+            flask.abort(400, 'format must be csv' + (' or parquet' if PARQUET_AVAILABLE else ''))
+        selection = parseSelection(flask.request.values)
+        # The snapshot is taken once, so a reload during the download does
+        # not mix two versions of the data
+        snapshot = store.snapshot
+        write = csvChunks if fileFormat == 'csv' else parquetChunks
+
+        def stream():
+            with timed('export.' + fileFormat) as timing:
+                timing.rows = timing.bytes = 0
+                for data in write(_counted(selectedChunks(snapshot, selection), timing), selection['grouping']):
+                    timing.bytes += len(data)
+                    yield data
+
+        filename = f"{selection['commodity']}_{selection['metric']}_{selection['grouping']}.{fileFormat}"
+        return flask.Response(stream(), mimetype=FORMATS[fileFormat],
+                              headers={'Content-Disposition': f'attachment; filename="{filename}"'})
@@ -0,0 +1,173 @@
+""" This file defines the fact table that is the canonical form of the energy
+    data. Each row of the fact table holds one property's electricity or gas
+    usage and spending for one month:
+
+        property | office | commodity | period | usage | spend
+
+    property, office, and commodity are categoricals, period is a monthly
+    pandas Period, and usage and spend are float32. The wide dataframes that
+    the charts and tables use (one row per property or office and one column
+    per month, labelled like 'Jan_2022') come from the matrices that
+    rollup.py builds from this table (see EntityMatrix.toFrame). """
+
+from types import MappingProxyType
+import numpy as np
+import pandas as pd
+from src.metrics import timedStage
+from src.names import internNames
+
+# Unit column used in the utility workbooks for each commodity
+COMMODITY_UNITS = {'electricity': 'kWh', 'gas': 'therms'}
+
+# Fact table column holding each metric shown in the dashboard
+METRIC_COLUMNS = {'usage': 'usage', 'spending': 'spend'}
+
+# Fact table column holding each grouping used in the dashboard
+GROUPING_COLUMNS = {'Property_Name': 'property', 'Office': 'office'}
+
+# Every grouping shown in the dashboard: properties, offices, and the county
+# as a whole, which every property rolls up to (see rollup.py)
+GROUPINGS = ('Property_Name', 'Office', 'County')
+
+# Name of the one row of the 'County' grouping
+COUNTY = 'Cook County'
+
+FACT_COLUMNS = ['property', 'office', 'commodity', 'period', 'usage', 'spend']
+
+# Format of the month labels used as column names in the wide views
+PERIOD_LABEL_FORMAT = '%b_%Y'
+
+# This function converts the columns of a long dataframe to the dtypes of the
+# fact table. Property and office names are interned, so their categorical
+# codes are ids into the sorted list of names and pivots come out in name order
+def _applyFactDtypes(facts):
+    for column in ('property', 'office'):
+        ids, names = internNames(facts[column])
+        facts[column] = pd.Categorical.from_codes(ids, categories=names)
+    facts['commodity'] = pd.Categorical(facts['commodity'], categories=list(COMMODITY_UNITS))
+    facts['period'] = facts['period'].astype('period[M]')
+    facts['usage'] = facts['usage'].astype(np.float32)
+    facts['spend'] = facts['spend'].astype(np.float32)
+    return facts[FACT_COLUMNS].reset_index(drop=True)
+
+# This function attaches each property's office from the propNamesAndOffices
+# dataframe. A property listed more than once keeps its first office, so each
+# property is counted in exactly one office
+def officeLookup(propNamesAndOffices):
+    mapping = propNamesAndOffices.drop_duplicates(subset='Property_Name')
+    return mapping.set_index('Property_Name')['Office']
+
+# This function builds one commodity's facts from its yearly bills dataframes
+# in a single pass. All bills are stacked once and duplicate bills for a
+# property in a month are averaged with one groupby. Within a fiscal-year file,
+# a property that appears in any month gets 0 for the months it has no bill;
+# outside its files it has no rows. When two files contain the same month, the
+# earliest file supplies it
+# INPUT: Chronological list of yearly bills dataframes with property, period,
+#        usage, and spend columns
+# OUTPUT: Dataframe with property, period, usage, and spend columns
+@timedStage('ingest.commodity_facts', rows=len)
+def commodityFacts(yearDfs):
+    bills = pd.concat([df.assign(file=i) for i, df in enumerate(yearDfs)], ignore_index=True)
+    means = bills.groupby(['file', 'property', 'period'], sort=False)[['usage', 'spend']].mean()
+
+    filePeriods = bills[['file', 'period']].drop_duplicates()
+    filePeriods = filePeriods[filePeriods['file'] == filePeriods.groupby('period')['file'].transform('min')]
+    fileProperties = bills[['file', 'property']].drop_duplicates()
+    coverage = fileProperties.merge(filePeriods, on='file')
+
+    facts = coverage.merge(means.reset_index(), on=['file', 'property', 'period'], how='left')
+    facts[['usage', 'spend']] = facts[['usage', 'spend']].fillna(0)
+    return facts.drop(columns='file')
+
+# This function combines facts built by commodityFacts into the fact table and
+# attaches each property's office. It is cheap compared to commodityFacts, so
+# one commodity can be rebuilt without touching the other
+# INPUT: Dictionary mapping 'electricity'/'gas' to commodityFacts output;
+#        propNamesAndOffices dataframe
+# OUTPUT: Fact table dataframe
+@timedStage('ingest.combine_facts', rows=len)
+def combineFacts(factsByCommodity, propNamesAndOffices):
+    frames = [facts.assign(commodity=commodity) for commodity, facts in factsByCommodity.items()]
+    facts = pd.concat(frames, ignore_index=True)
+    facts['office'] = facts['property'].map(officeLookup(propNamesAndOffices))
+    return _applyFactDtypes(facts)
+
+# This function marks an array read-only and returns it. Data in a snapshot is
+# shared by every request (and, when served by gunicorn, every worker), so it
+# is never written to; an attempt raises ValueError instead of racing
+def readOnly(array):
+    array.setflags(write=False)
+    return array
+
+# This function marks the arrays behind every column of a dataframe
+# read-only and returns it, so an in-place edit of a dataframe the snapshot
+# shares (e.g. the fact table) raises ValueError too. The dataframe is
+# consolidated first, so pandas does not later replace its arrays with new,
+# writable ones. Categorical and Period columns are marked through the
+# codes and ordinals they hold
+def readOnlyFrame(df):
+    df._consolidate_inplace()
+    for values in df._mgr.arrays:
+        array = getattr(values, '_ndarray', values)
+        if isinstance(array, np.ndarray):
+            readOnly(array)
+    return df
+
+# A dense matrix of one measure with one row per property or office and one
+# column per month, together with the names of the rows and a name -> row
+# lookup, so any set of rows can be picked out with fancy indexing. A matrix
+# may hold only some of the rows of the full one (see subset); positions are
+# then the rows the names have in the full matrix
+class EntityMatrix:
+    def __init__(self, entities, periods, values, positions=None):
+        self.entities = tuple(entities)
+        self.periods = periods
+        self.labels = tuple(periods.strftime(PERIOD_LABEL_FORMAT))
+        self.values = readOnly(values)
+        self.rowOf = MappingProxyType({name: row for row, name in enumerate(self.entities)})
+        if positions is None:
+            self.positionOf = self.rowOf
+        else:
+            self.positionOf = MappingProxyType(dict(zip(self.entities, (int(p) for p in positions))))
+
+    # This method returns the rows for the given names, in matrix (name)
+    # order. Names that are not in the matrix are skipped
+    def rowsFor(self, names):
+        return np.array(sorted(self.rowOf[n] for n in set(names) if n in self.rowOf), dtype=np.intp)
+
+    # This method picks out the given names. When they are a run of
+    # consecutive rows (e.g. all of them) the values are a view of the matrix
+    # rather than a copy; either way they are read-only
+    # OUTPUT: List of the names found; their rows of the matrix
+    def select(self, names):
+        rows = self.rowsFor(names)
+        if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+            return list(self.entities[rows[0]:rows[-1] + 1]), self.values[rows[0]:rows[-1] + 1]
+        return [self.entities[r] for r in rows], readOnly(self.values[rows])
+
+    # This method returns one name's row of the matrix as a read-only view
+    def row(self, name):
+        return self.values[self.rowOf[name]]
+
+    # This method returns a matrix of just the given names, with every month
+    # OUTPUT: EntityMatrix
+    def subset(self, names):
+        rows = self.rowsFor(names)
+        _, values = self.select(names)
+        return EntityMatrix([self.entities[r] for r in rows], self.periods, values,
+                            [self.positionOf[self.entities[r]] for r in rows])
+
+    # This method returns the matrix as a wide dataframe with the grouping as
+    # its first column and one column per month labelled like 'Jan_2022'
+    def toFrame(self, officeOrProp):
+        wide = pd.DataFrame(self.values, columns=list(self.labels))
+        wide.insert(0, officeOrProp, self.entities)
+        return wide
+
+# This function returns the facts behind the matrices of one commodity and
+# grouping: that commodity's rows that have a property or office
+def matrixFacts(facts, commodity, officeOrProp):
+    key = GROUPING_COLUMNS[officeOrProp]
+    rows = facts[facts['commodity'] == commodity]
+    return rows[rows[key].notna()]
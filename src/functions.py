@@ -1,203 +1,182 @@
 """ This file contains functions that read in electricity and gas
-    spending and usage data from the electricity_data and gas_data folders
-    in the data folder. These folders should contain files for 2021, 2022,
-    and 2023. This file ultimately produces a dictionary containing all of the
-    dataframes that are used in the charts_and_tables files to create the charts
-    and tables that are depicted in the dashboard. """
-
-from functools import reduce
+    spending and usage data from the workbooks in the data folder, one
+    originalElectricityYYYY and one originalGasYYYY file per fiscal year
+    (see loader.py for how they are found), and turn them into the fact table
+    that all of the dataframes used in the charts_and_tables files are built
+    from. Importing this file does not read anything: the data is loaded by the
+    DataStore in store.py the first time it is needed. The module-level names
+    that used to hold the data (all_data_dict, properties, offices, ...) are
+    still available and are looked up in the store when accessed. """
+
+import os
 import re
 import pandas as pd
+from src.excel_cache import readExcelCached
+from src.loader import DATA_DIR, OFFICES_FILE, isFiscalYearSheet, parseWorkbooks
+from src.facts import COMMODITY_UNITS
+from src.metrics import timed, timedStage
+from src.names import makeStringsNice, normalizeNames
 
 # Create a class for the Excel files that will contain the file, the sheet names
 # in the file, and the year of the file to make accessing these items/values
-# more efficient/simpler
+# more efficient/simpler. The sheets are loaded through the cache in
+# excel_cache.py; pass rebuild=True to force the workbook to be parsed again,
+# or pass sheets that have already been parsed (e.g. by loader.py) as file
 class readEnergyExcelFiles:
-    def __init__(self, filename):
-        self.file = pd.read_excel('./data/' + filename + '.xlsx', sheet_name=None)
+    def __init__(self, filename, rebuild=False, file=None):
+        if file is None:
+            file = readExcelCached(os.path.join(DATA_DIR, filename + '.xlsx'), rebuild=rebuild)
+        self.file = file
         self.sheets = list(self.file.keys())
         self.year = None
         match = re.search(r"\d{4}", filename)
         if match:
             self.year = f"{match.group()}"
 
-## Get the excel files for 2021, 2022, 2023
-ogElecFile21 = readEnergyExcelFiles('originalElectricity2021')
-ogElecFile22 = readEnergyExcelFiles('originalElectricity2022')
-ogElecFile23 = readEnergyExcelFiles('originalElectricity2023')
-
-## Get the excel files for 2021, 2022, 2023
-ogGasFile21 = readEnergyExcelFiles('originalGas2021')
-ogGasFile22 = readEnergyExcelFiles('originalGas2022')
-ogGasFile23 = readEnergyExcelFiles('originalGas2023')
+# This function parses the given workbooks found by loader.py (see
+# discoverWorkbooks and neededWorkbooks there)
+# INPUT: List of Workbooks
+# OUTPUT: Dictionary mapping each Workbook to its file processed using
+#         readEnergyExcelFiles
+def readWorkbooks(workbooks):
+    return {w: readEnergyExcelFiles(w.name, file=sheets) for w, sheets in parseWorkbooks(workbooks).items()}
 
 # Get rid of chained assignment warnings
 pd.set_option('mode.chained_assignment', None)
 
-# This function removes possibly dangerous characters
-# INPUT: String
-# OUTPUT: String
-def makeStringsNice(string):
-    string = str(string)
-    string = string.lower().strip()
-    string = string.replace('-', '').replace(' ', '_').replace('.', '').replace('#', '').replace('&', '').replace('(', '').replace(')', '').replace('__', '_').replace('\'s', '')
-    return string
-
-# Extract lists of Cook County's properties and offices from the
-# propertyNamesAndOffices Excel file
-propNamesAndOffices = pd.read_excel('./propertyNamesAndOffices.xlsx')
-propNamesAndOffices['Property_Name'] = propNamesAndOffices['Property_Name'].apply(makeStringsNice)
-propNamesAndOffices['Office'] = propNamesAndOffices['Office'].apply(makeStringsNice)
-properties = list(propNamesAndOffices['Property_Name'].unique())
-offices = list(propNamesAndOffices['Office'].unique())
+# This function reads the propertyNamesAndOffices Excel file, which maps each
+# of Cook County's properties to its office, and makes the names nice
+def loadPropNamesAndOffices(path=OFFICES_FILE):
+    propNamesAndOffices = next(iter(readExcelCached(path).values()))
+    propNamesAndOffices['Property_Name'] = normalizeNames(propNamesAndOffices['Property_Name'])
+    propNamesAndOffices['Office'] = normalizeNames(propNamesAndOffices['Office'])
+    return propNamesAndOffices
+
+# This function lists the monthly sheets ('YYYY-Mon') of an Excel file processed
+# using readEnergyExcelFiles that belong to its fiscal year, which also covers
+# the months of the previous calendar year that appear in the file
+# INPUT: File processed using readEnergyExcelFiles
+# OUTPUT: List of sheet names
+def monthSheetsOf(excFile):
+    return [sheet for sheet in excFile.sheets if isFiscalYearSheet(sheet, excFile.year)]
+
+# This function cleans one monthly sheet: it drops entries that are na in the
+# kWh/therms and property name columns, makes the property names nice, and
+# converts the columns to the appropriate data types
+# INPUT: Dataframe of one monthly sheet; string indicating the unit column
+# OUTPUT: Dataframe with the Property_Name, unit, and Total_Amount columns
+def cleanMonthSheet(sheetDf, string):
+    # rename returns a new dataframe, so the sheets stored in the workbook
+    # are never changed and can be processed again by later calls
+    dataframe=sheetDf.rename(columns=lambda c: c.replace(' ', '_'))
+
+    # Drop entries that are na in the kWh/therms and property name columns
+    dataframe[string] = pd.to_numeric(dataframe[string], errors='coerce')
+    dataframe.dropna(axis=0, subset=(string, 'Property_Name'), inplace=True)
+    dataframe['Property_Name'] = normalizeNames(dataframe['Property_Name'])
+
+    # Convert columns explicitly to appropriate data types
+    df = dataframe[['Property_Name', string, 'Total_Amount']]
+    df['Property_Name'] = df['Property_Name'].astype(str)
+    df[string] = df[string].astype(float)
+    df['Total_Amount'] = df['Total_Amount'].astype(float)
+    return df
 
 # This function takes in an Excel file processed using readEnergyExcelFiles
-# above. It prepares the monthly sheets in the file for a merge by isolating the
-# Property Name, kWh/therms, and Total Amount columns in each sheet and pivoting it
-# to aggregate rows where 'Property Name' is the same, and appending it to the
-# desiredSheetsList, which will be merged to create a yearly usage and spending df
-# NOTE: Function only works for the 2022 and 2023 Gas/Electriciy Excel files
-# INPUT: Pandas dataframe read from Excel file; string indicating the unit to be
-#        used – kWh for electricity and therms for gas
-# OUTPUT: List of dataframes containing each month's electricity and usage data
+# above. It cleans each monthly sheet in the file's fiscal year and converts it
+# to long form, with one row per bill and the month stored as a Period
+# INPUT: File processed using readEnergyExcelFiles; string indicating the unit
+#        to be used – kWh for electricity and therms for gas
+# OUTPUT: List of dataframes with property, period, usage, and spend columns
 def addMonthsDataToList(excFile, string):
     listOfMonthsData = list()
-    for sheet in excFile.sheets:
-        if (((excFile.year + '-') in sheet) | ((str(int(excFile.year) - 1) + '-') in sheet)):
-
-            month=sheet[-3:]
-            year=sheet[0:4]
-
-            dataframe=excFile.file[sheet]
-            dataframe.columns=[c.replace(' ', '_') for c in dataframe.columns]
-
-            # Drop entries that are na in the kWh/therms and property name columns
-            dataframe[string] = pd.to_numeric(dataframe[string], errors='coerce')
-            dataframe.dropna(axis=0, subset=(string, 'Property_Name'), inplace=True)
-            dataframe['Property_Name'].fillna(dataframe['Service_Address'], inplace=True)
-            dataframe['Property_Name'] = dataframe['Property_Name'].apply(makeStringsNice)
-            columns_to_keep=['Property_Name', string, 'Total_Amount']
-            columns_to_select = dataframe.columns.str.contains('|'.join(columns_to_keep), regex=True)
-            df = dataframe[dataframe.columns[columns_to_select]]
-            #df=dataframe.filter(regex=f'Property_Name|{string}|Total_Amount')
-
-            # Convert columns explicitly to appropriate data types
-            df['Property_Name'] = df['Property_Name'].astype(str)
-            df[string] = df[string].astype(float)
-            df['Total_Amount'] = df['Total_Amount'].astype(float)
-
-            # Set property name as index before adding month suffix to other columns
-            df.set_index('Property_Name', inplace=True)
-            df=df.pivot_table(index='Property_Name').add_suffix(f'_{month}_{year}')
-            df.reset_index(inplace=True)
-
-            listOfMonthsData.append(df)
+    for sheet in monthSheetsOf(excFile):
+        month=sheet[-3:]
+        year=sheet[0:4]
+        with timed('ingest.clean_sheet') as timing:
+            df = cleanMonthSheet(excFile.file[sheet], string)
+            timing.rows = len(df)
+        listOfMonthsData.append(pd.DataFrame({
+            'property': df['Property_Name'].to_numpy(),
+            'period': pd.Period(f'{year}-{month}', freq='M'),
+            'usage': df[string].to_numpy(),
+            'spend': df['Total_Amount'].to_numpy(),
+        }))
     return listOfMonthsData
 
-# This function merges a list of dataframes containing usage and spending data for
-# for each facility in Cook County, output by the above addMonthsDataToList
+# This function stacks the monthly dataframes output by addMonthsDataToList into
+# one dataframe of bills for the year. Bills are combined per property and
+# month later, by commodityFacts in facts.py
+@timedStage('ingest.merge_year', rows=len)
 def mergeMonthsSheetsToYear(listOfMonthSheets):
-    yearDf = reduce(lambda x, y: pd.merge(x, y, how='outer', on='Property_Name'), listOfMonthSheets)
-    yearDf.fillna(0, inplace=True)
-    return yearDf
+    return pd.concat(listOfMonthSheets, ignore_index=True)
+
+# This function builds the combined, usage, and spending dataframes for one
+# commodity, grouped both by property and by office, from a snapshot's
+# matrices (see Snapshot.matrix in store.py)
+# INPUT: String, 'gas' or 'electricity'; Snapshot (defaults to the store's)
+# OUTPUT: Dictionary keyed by 'Property_Name' and 'Office', each holding the
+#         'total', 'usage', and 'spending' dataframes
+def aggregateCommodity(gasOrElec, snapshot=None):
+    if snapshot is None:
+        from src.store import store
+        snapshot = store.snapshot
+    unit = COMMODITY_UNITS[gasOrElec]
+    result = dict()
+    for officeOrProp in ('Property_Name', 'Office'):
+        usage = snapshot.matrix(gasOrElec, 'usage', officeOrProp).toFrame(officeOrProp)
+        spending = snapshot.matrix(gasOrElec, 'spending', officeOrProp).toFrame(officeOrProp)
+        total = pd.concat([
+            usage.set_index(officeOrProp).add_prefix(f'{unit}_'),
+            spending.set_index(officeOrProp).add_prefix('Total_Amount_'),
+        ], axis=1).reset_index()
+        result[officeOrProp] = {
+            'total' : total,
+            'usage' : usage,
+            'spending' : spending
+        }
+    return result
 
 # This function takes in two strings, gasOrElec, which denotes whether the
 # the function is dealing with gas or electricity data, and officeOrProp, which
-# denotes whether the data should be grouped by offices or properties
+# denotes whether the data should be grouped by offices or properties. It is
+# kept for callers that only need one grouping; aggregateCommodity builds both
 def aggregateYears(gasOrElec, officeOrProp):
-    if gasOrElec=='gas':
-        unit='therms'
-        listOfYearlongDfs = [ogGasFile22, ogGasFile23]
-    else:
-        unit='kWh'
-        listOfYearlongDfs = [ogElecFile22, ogElecFile23]
-
-    # Months sheets for usage and spending 2022 and 2023
-    months22 = addMonthsDataToList(listOfYearlongDfs[0], unit)
-    months23 = addMonthsDataToList(listOfYearlongDfs[1], unit)
-
-    # Dataframes containing usage and spending data for 2022 and 2023
-    df22 = mergeMonthsSheetsToYear(months22)
-    df23 = mergeMonthsSheetsToYear(months23)
-
-    # Merging 2022 and 2023 dataframes, dropping duplicated columns
-    # Adapted from code found on pauldesalvo.com
-    df = pd.merge(df22, df23, how='outer', on='Property_Name', suffixes=('', '_drop'))
-    df.drop([col for col in df.columns if 'drop' in col], axis=1, inplace=True)
-
-    df = pd.merge(df, propNamesAndOffices, how='left', on='Property_Name')
-    columns_to_keep=[officeOrProp, unit, 'Total_Amount']
-    columns_to_select = df.columns.str.contains('|'.join(columns_to_keep), regex=True)
-    df = df[df.columns[columns_to_select]]
-
-    # If officeOrProp is 'Office', pivot the table to get the data grouped by
-    # offices rather than properties
-    if officeOrProp == 'Office':
-        columns=list(df.columns)
-        columns.insert(0, columns.pop(columns.index('Office')))
-        df=df.pivot_table(index='Office', aggfunc='sum')
-        df.reset_index(inplace=True)
-        df = df[columns]
-
-    # Dictionary containing one dataframe for usage and the other for spending
-    usage = df.filter(regex=f'{officeOrProp}|{unit}')
-    usage.columns = usage.columns.str.removeprefix(f'{unit}_')
-
-    spending = df.filter(regex=f'{officeOrProp}|Total_Amount')
-    spending.columns = spending.columns.str.removeprefix('Total_Amount_')
-
-    # Dictionary containing dataframes for usage, spending, and combined
-    usageSpendingDict = {
-        'total' : df,
-        'usage' : usage,
-        'spending' : spending
-    }
-    return usageSpendingDict
-
-# Combined usage and spending electricity data for Cook County offices
-elec_offices = aggregateYears('electricity', 'Office')['total']['Office']
-# Combined usage and spending gas data for Cook County offices
-gas_offices = aggregateYears('gas', 'Office')['total']['Office']
-
-# Combined usage and spending electricity data for Cook County facilities
-elec_properties = aggregateYears('electricity', 'Property_Name')['total']['Property_Name']
-# Combined usage and spending gas data for Cook County facilities
-gas_properties = aggregateYears('gas', 'Property_Name')['total']['Property_Name']
-
-# Electricity usage data for Cook County facilities
-elec_usage_props = aggregateYears('electricity', 'Property_Name')['usage']
-# Electricity usage data for Cook County offices
-elec_usage_offs = aggregateYears('electricity', 'Office')['usage']
-
-# Electricity spending data for Cook County facilities
-elec_spend_props = aggregateYears('electricity', 'Property_Name')['spending']
-# Electricity spending data for Cook County offices
-elec_spend_offs = aggregateYears('electricity', 'Office')['spending']
-
-# Gas usage data for Cook County facilities
-gas_usage_props = aggregateYears('gas', 'Property_Name')['usage']
-# Gas usage data for Cook County offices
-gas_usage_offs = aggregateYears('gas', 'Office')['usage']
-
-# Gas spending data for Cook County facilities
-gas_spend_props = aggregateYears('gas', 'Property_Name')['spending']
-# Gas spending data for Cook County offices
-gas_spend_offs = aggregateYears('gas', 'Office')['spending']
-
-# Dictionary containing all eight of the electricity and gas spending and usage
-# dataframes to be accessed 
-all_data_dict = {
-    ('electricity', 'usage', 'Property_Name'): elec_usage_props,
-    ('electricity', 'usage', 'Office'): elec_usage_offs,
-    ('electricity', 'spending', 'Property_Name'): elec_spend_props,
-    ('electricity', 'spending', 'Office'): elec_spend_offs,
-    ('gas', 'usage', 'Property_Name'): gas_usage_props,
-    ('gas', 'usage', 'Office'): gas_usage_offs,
-    ('gas', 'spending', 'Property_Name'): gas_spend_props,
-    ('gas', 'spending', 'Office'): gas_spend_offs,
+    return aggregateCommodity(gasOrElec)[officeOrProp]
+
+# Names of the dataframes that used to be built when this file was imported,
+# and the (commodity, metric, grouping) view of the store each one stands for
+_LEGACY_VIEWS = {
+    'elec_usage_props': ('electricity', 'usage', 'Property_Name'),
+    'elec_usage_offs': ('electricity', 'usage', 'Office'),
+    'elec_spend_props': ('electricity', 'spending', 'Property_Name'),
+    'elec_spend_offs': ('electricity', 'spending', 'Office'),
+    'gas_usage_props': ('gas', 'usage', 'Property_Name'),
+    'gas_usage_offs': ('gas', 'usage', 'Office'),
+    'gas_spend_props': ('gas', 'spending', 'Property_Name'),
+    'gas_spend_offs': ('gas', 'spending', 'Office'),
+    'elec_offices': ('electricity', 'usage', 'Office'),
+    'gas_offices': ('gas', 'usage', 'Office'),
+    'elec_properties': ('electricity', 'usage', 'Property_Name'),
+    'gas_properties': ('gas', 'usage', 'Property_Name'),
 }
 
-# Sorted list of Cook County facilities
-properties = sorted(properties)
-# Sorted list of Cook County Offices
-offices = sorted(offices)
\ No newline at end of file
+# Names that are read straight from the store
+_STORE_ATTRIBUTES = ('properties', 'offices', 'propNamesAndOffices', 'energyFiles')
+
+# Module-level names such as all_data_dict are looked up lazily in the store,
+# so importing this file stays cheap
+def __getattr__(name):
+    from src.store import store
+    if name == 'all_data_dict':
+        return store
+    if name == 'fact_table':
+        return store.facts
+    if name in _STORE_ATTRIBUTES:
+        return getattr(store, name)
+    if name in _LEGACY_VIEWS:
+        key = _LEGACY_VIEWS[name]
+        view = store[key]
+        # elec_offices, gas_properties, etc. only held the names
+        return view[key[2]] if name.endswith(('_offices', '_properties')) else view
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,114 @@
+""" This file finds the electricity and gas workbooks in the data folder and
+    parses the ones the dashboard needs. Workbooks are named
+    originalElectricityYYYY.xlsx and originalGasYYYY.xlsx, where YYYY is the
+    fiscal year, so adding a year of history only means dropping its two
+    files into the folder. Workbooks that are not already in the Excel cache
+    are parsed in parallel in a process pool. Its processes are spawned
+    rather than forked: the store parses workbooks from background threads
+    (warm() and the data watcher), and a process forked while another thread
+    holds a lock (e.g. the metrics registry's or logging's) could hang on
+    it.
+
+    By default only the month sheets of each workbook's fiscal year, and only
+    the columns the dashboard uses, are read (see excel_stream.py). Set
+    ENERGY_EXCEL_READ=full to read every sheet and column with pd.read_excel
+    as before. """
+
+import functools
+import multiprocessing
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from src.excel_cache import isCached, readExcelCached
+from src.excel_stream import readSheetColumns
+from src.facts import COMMODITY_UNITS
+from src.metrics import timedStage
+
+# Folder holding the workbooks, can be moved with ENERGY_DATA_DIR
+DATA_DIR = os.environ.get('ENERGY_DATA_DIR', './data')
+
+# Workbook mapping each property to its office, set with ENERGY_OFFICES_FILE
+OFFICES_FILE = os.environ.get('ENERGY_OFFICES_FILE', './propertyNamesAndOffices.xlsx')
+
+# Number of most recent fiscal years to load, set ENERGY_HISTORY_YEARS=all to
+# load every year found in the data folder
+HISTORY_YEARS = os.environ.get('ENERGY_HISTORY_YEARS', '2')
+
+# Maximum number of processes used to parse workbooks, defaults to one per CPU
+PARSE_WORKERS = int(os.environ.get('ENERGY_PARSE_WORKERS', '0')) or os.cpu_count() or 1
+
+# 'selective' to stream only the sheets and columns used, 'full' to read the
+# whole workbook
+READ_MODE = os.environ.get('ENERGY_EXCEL_READ', 'selective')
+
+WORKBOOK_PATTERN = re.compile(r'^original(Electricity|Gas)(\d{4})\.xlsx$')
+
+# One workbook found in the data folder
+Workbook = namedtuple('Workbook', ['commodity', 'year', 'name', 'path'])
+
+# This function tells whether a sheet holds a month of the given fiscal year.
+# Month sheets are named 'YYYY-Mon', and a fiscal year's workbook also holds
+# months of the previous calendar year
+def isFiscalYearSheet(sheet, year):
+    return ((str(year) + '-') in sheet) | ((str(int(year) - 1) + '-') in sheet)
+
+# This function lists the electricity and gas workbooks in the data folder
+# INPUT: Path of the data folder
+# OUTPUT: List of Workbooks sorted by commodity and year
+def discoverWorkbooks(dataDir=DATA_DIR):
+    workbooks = list()
+    for filename in os.listdir(dataDir):
+        match = WORKBOOK_PATTERN.match(filename)
+        if match:
+            commodity = match.group(1).lower()
+            workbooks.append(Workbook(commodity, int(match.group(2)), filename[:-len('.xlsx')],
+                                      os.path.join(dataDir, filename)))
+    return sorted(workbooks, key=lambda w: (w.commodity, w.year))
+
+# This function keeps the workbooks for the most recent fiscal years
+# INPUT: List of Workbooks; number of years to keep, or 'all'
+# OUTPUT: List of Workbooks
+def neededWorkbooks(workbooks, historyYears=HISTORY_YEARS):
+    if str(historyYears).lower() in ('all', '0'):
+        return list(workbooks)
+    years = sorted({w.year for w in workbooks})[-int(historyYears):]
+    return [w for w in workbooks if w.year in years]
+
+# Name the Excel cache keeps a workbook's selective read under; full reads
+# have none
+def _cacheVariant(workbook):
+    return None if READ_MODE == 'full' else 'columns-' + COMMODITY_UNITS[workbook.commodity]
+
+# Runs in a worker process: parse one workbook (or load it from the cache)
+# and keep only the sheets of its fiscal year, so less data is sent back.
+# With rebuild=True the workbook is parsed even if it is cached
+def _parseWorkbook(workbook, rebuild=False):
+    keep = lambda sheet: isFiscalYearSheet(sheet, workbook.year)
+    if READ_MODE == 'full':
+        sheets = readExcelCached(workbook.path, rebuild=rebuild)
+        return {sheet: df for sheet, df in sheets.items() if keep(sheet)}
+    unit = COMMODITY_UNITS[workbook.commodity]
+    return readExcelCached(workbook.path, rebuild=rebuild, reader=lambda path: readSheetColumns(path, unit, keep),
+                           variant=_cacheVariant(workbook))
+
+# This function parses the given workbooks. Workbooks that are already cached
+# are loaded in this process (unless rebuild is True); the rest are parsed in
+# parallel
+# INPUT: List of Workbooks; maximum number of worker processes; whether to
+#        parse the workbooks again even if they are cached
+# OUTPUT: Dictionary mapping each Workbook to its month sheets
+@timedStage('ingest.parse_workbooks', rows=len)
+def parseWorkbooks(workbooks, workers=PARSE_WORKERS, rebuild=False):
+    toParse = [w for w in workbooks if rebuild or not isCached(w.path, _cacheVariant(w))]
+    parse = functools.partial(_parseWorkbook, rebuild=rebuild)
+    parsed = dict()
+    # Worker processes never start pools of their own
+    if len(toParse) > 1 and workers > 1 and multiprocessing.parent_process() is None:
+        with ProcessPoolExecutor(max_workers=min(workers, len(toParse)),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            parsed.update(zip(toParse, pool.map(parse, toParse)))
+    for workbook in workbooks:
+        if workbook not in parsed:
+            parsed[workbook] = parse(workbook)
+    return {w: parsed[w] for w in workbooks}
@@ -0,0 +1,118 @@
+""" This file load tests a running dashboard. It sends the same requests the
+    browser does when the user changes the main tab's selections, pages the
+    table, or changes the averages tab, from a growing number of concurrent
+    client processes, and reports requests per second and latency at each
+    level. Selections are drawn at random so most requests miss the callback
+    cache and measure real work. Run it against the development server or
+    against gunicorn with different ENERGY_WORKERS to see throughput scale
+    with the number of cores:
+
+        gunicorn wsgi:server &
+        python -m src.loadtest --url http://127.0.0.1:8050 --clients 1,2,4,8 """
+
+import argparse
+import json
+import random
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+import src.components.layout.ids as ids
+
+# This function posts one callback request and returns the decoded response
+def postCallback(url, body):
+    request = urllib.request.Request(url + '/_dash-update-component', data=json.dumps(body).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+def _prop(id, prop, value=None):
+    return {'id': id, 'property': prop, 'value': value}
+
+# Requests for the options store, the main tab, and the averages tab, written
+# the way the browser writes them
+def optionsRequest():
+    return {'output': ids.OPTIONS_STORE + '.data', 'outputs': _prop(ids.OPTIONS_STORE, 'data'),
+            'inputs': [_prop(ids.URL, 'pathname', '/')], 'changedPropIds': [ids.URL + '.pathname']}
+
+def mainRequest(options, rng):
+    outputs = [_prop(ids.MAIN_GRAPH, 'figure'), _prop(ids.CHART_STATE, 'data')]
+    outputs += [_prop(ids.MAIN_DATATABLE, p) for p in ('data', 'columns', 'tooltip_data', 'page_count', 'page_current')]
+    grouping = rng.choice(['Property', 'Office'])
+    names = options['properties'] if grouping == 'Property' else options['offices']
+    selected = rng.sample(names, rng.randint(1, len(names)))
+    inputs = [
+        _prop(ids.GAS_OR_ELEC, 'value', rng.choice(['Gas', 'Electricity'])),
+        _prop(ids.USAGE_OR_SPENDING, 'value', rng.choice(['Usage', 'Spending'])),
+        _prop(ids.OFFICES_OR_PROPS, 'value', grouping),
+        _prop(ids.OFFS_PROPS_DROPDOWN, 'value', selected),
+        _prop(ids.MAIN_DATATABLE, 'page_current', 0),
+        _prop(ids.MAIN_DATATABLE, 'page_size', 17),
+        _prop(ids.MAIN_DATATABLE, 'sort_by', []),
+        _prop(ids.MAIN_DATATABLE, 'filter_query', ''),
+    ]
+    return {'output': '..' + '...'.join(o['id'] + '.' + o['property'] for o in outputs) + '..',
+            'outputs': outputs, 'inputs': inputs, 'state': [_prop(ids.CHART_STATE, 'data')],
+            'changedPropIds': [ids.OFFS_PROPS_DROPDOWN + '.value']}
+
+def averagesRequest(options, rng):
+    grouping = rng.choice(['Property', 'Office'])
+    names = options['properties'] if grouping == 'Property' else options['offices']
+    months = rng.sample(options['dates'], rng.randint(1, len(options['dates'])))
+    return {'output': ids.AVE + '.children', 'outputs': _prop(ids.AVE, 'children'),
+            'inputs': [_prop(ids.O_OR_P_AVE, 'value', grouping), _prop(ids.OP_DROPDOWN_AVE, 'value', rng.choice(names)),
+                       _prop(ids.DATES_DROPDOWN_AVE, 'value', months)],
+            'changedPropIds': [ids.DATES_DROPDOWN_AVE + '.value']}
+
+# Runs in a client process: send requests for the given number of seconds
+# OUTPUT: List of request latencies in seconds; number of failed requests
+def _client(url, options, seconds, seed):
+    rng = random.Random(seed)
+    latencies, failures = list(), 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        body = mainRequest(options, rng) if rng.random() < 0.7 else averagesRequest(options, rng)
+        start = time.perf_counter()
+        try:
+            postCallback(url, body)
+        except Exception:
+            failures += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    return latencies, failures
+
+# This function runs one level of the load test
+# OUTPUT: Dictionary of clients, requests, failures, requests per second, and
+#         median and 95th percentile latency in milliseconds
+def runLevel(url, options, clients, seconds):
+    with ProcessPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(_client, [url] * clients, [options] * clients, [seconds] * clients,
+                                range(clients)))
+    latencies = sorted(l for result in results for l in result[0])
+    failures = sum(result[1] for result in results)
+    p95 = latencies[int(0.95 * (len(latencies) - 1))] if latencies else float('nan')
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'failures': failures,
+        'rps': len(latencies) / seconds,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else float('nan'),
+        'p95_ms': p95 * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test a running dashboard')
+    parser.add_argument('--url', default='http://127.0.0.1:8050')
+    parser.add_argument('--clients', default='1,2,4,8', help='comma-separated numbers of concurrent clients')
+    parser.add_argument('--seconds', type=float, default=10, help='length of each level')
+    args = parser.parse_args()
+
+    options = postCallback(args.url, optionsRequest())['response'][ids.OPTIONS_STORE]['data']
+    print('%8s %9s %9s %9s %9s %9s' % ('clients', 'requests', 'failures', 'req/s', 'p50 ms', 'p95 ms'))
+    for clients in [int(c) for c in args.clients.split(',')]:
+        result = runLevel(args.url, options, clients, args.seconds)
+        print('%8d %9d %9d %9.1f %9.1f %9.1f' % (result['clients'], result['requests'], result['failures'],
+                                                 result['rps'], result['p50_ms'], result['p95_ms']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+""" This file keeps performance metrics for the dashboard and serves them in
+    the Prometheus text format at /metrics. Each stage of ingestion (reading
+    workbooks, cleaning sheets, merging, building facts and matrices) and
+    each callback records its wall time, the rows it processed, and, for
+    callbacks, the bytes of the response sent to the browser:
+
+        with timed('ingest.clean_sheet') as timing:
+            ...
+            timing.rows = len(df)
+
+    Every request to a Dash callback is also timed as a whole, labelled with
+    the callback's first output. Set ENERGY_PROFILE_DIR to a folder to run
+    each callback request under cProfile and write its profile there (only
+    requests slower than ENERGY_PROFILE_MIN_MS, default 0, are kept); open
+    them with pstats or snakeviz. Only one request is profiled at a time, as
+    only one profiler can run in a process at once: requests that arrive
+    while another is being profiled are timed but not profiled. Metrics are
+    kept per process, so under gunicorn each worker reports its own. """
+
+import cProfile
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+import flask
+
+# Folder to write per-request profiles to; profiling is off when it is not set
+PROFILE_DIR = os.environ.get('ENERGY_PROFILE_DIR')
+PROFILE_MIN_MS = float(os.environ.get('ENERGY_PROFILE_MIN_MS', '0'))
+
+# Held by the request being profiled
+_profileLock = threading.Lock()
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Totals for one stage
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.maxSeconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, seconds, rows, size):
+        self.count += 1
+        self.seconds += seconds
+        self.maxSeconds = max(self.maxSeconds, seconds)
+        self.rows += rows or 0
+        self.bytes += size or 0
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+class MetricsRegistry:
+    def __init__(self):
+        self._stages = dict()
+        self._gauges = dict()
+        self._lock = threading.Lock()
+
+    # This method records one run of a stage
+    def observe(self, stage, seconds, rows=None, size=None):
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats()
+            stats.add(seconds, rows, size)
+
+    # This method registers a gauge whose value is read from value() each time
+    # the metrics are rendered
+    def gauge(self, name, help, value):
+        self._gauges[name] = (help, value)
+
+    def stages(self):
+        with self._lock:
+            return {stage: vars(stats).copy() for stage, stats in self._stages.items()}
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+
+    # This method renders every metric in the Prometheus text format
+    def render(self):
+        stages = self.stages()
+        lines = [
+            '# HELP energy_stage_seconds Wall time of ingest stages and callbacks',
+            '# TYPE energy_stage_seconds histogram',
+        ]
+        for stage, stats in sorted(stages.items()):
+            label = f'stage="{stage}"'
+            for bound, count in zip(BUCKETS, stats['buckets']):
+                lines.append(f'energy_stage_seconds_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'energy_stage_seconds_bucket{{{label},le="+Inf"}} {stats["count"]}')
+            lines.append(f'energy_stage_seconds_sum{{{label}}} {stats["seconds"]:.6f}')
+            lines.append(f'energy_stage_seconds_count{{{label}}} {stats["count"]}')
+        families = [
+            ('energy_stage_seconds_max', 'gauge', 'Slowest run of each stage', 'maxSeconds'),
+            ('energy_stage_rows_total', 'counter', 'Rows processed by each stage', 'rows'),
+            ('energy_stage_payload_bytes_total', 'counter', 'Bytes of responses sent by each callback', 'bytes'),
+        ]
+        for name, kind, help, field in families:
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{{stage="{stage}"}} {stats[field]}' for stage, stats in sorted(stages.items())]
+        for name, (help, value) in sorted(self._gauges.items()):
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge', f'{name} {value()}']
+        return '\n'.join(lines) + '\n'
+
+# The registry every stage reports to
+registry = MetricsRegistry()
+
+# What a timed block can report about its work
+class Timing:
+    def __init__(self, rows=None):
+        self.rows = rows
+        self.bytes = None
+
+# This context manager times a block of code as one run of a stage. Set rows
+# (and bytes) on the object it yields to record the work done
+@contextmanager
+def timed(stage, rows=None):
+    timing = Timing(rows)
+    start = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        registry.observe(stage, time.perf_counter() - start, timing.rows, timing.bytes)
+
+# This decorator times every call of a function as one run of a stage. rows,
+# if given, is called with the function's result to count the rows processed
+def timedStage(stage, rows=None):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage) as timing:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    timing.rows = rows(result)
+                return result
+        return wrapper
+    return decorator
+
+# Name of the callback a Dash update request is for: the id and property of
+# its first output
+def _callbackName(body):
+    outputs = body.get('outputs')
+    first = outputs[0] if isinstance(outputs, list) else outputs
+    if isinstance(first, dict):
+        return f"{first.get('id')}.{first.get('property')}"
+    return str(body.get('output'))
+
+# This function adds /metrics to the Flask server behind a Dash app, and times
+# (and, with ENERGY_PROFILE_DIR set, profiles) every callback request
+def registerMetrics(server):
+    @server.route('/metrics')
+    def metrics():
+        return flask.Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    @server.before_request
+    def start_callback_timer():
+        if flask.request.path.endswith('/_dash-update-component'):
+            flask.g.energyStart = time.perf_counter()
+            if PROFILE_DIR and _profileLock.acquire(blocking=False):
+                flask.g.energyProfile = cProfile.Profile()
+                flask.g.energyProfile.enable()
+
+    @server.after_request
+    def record_callback(response):
+        start = flask.g.pop('energyStart', None)
+        if start is None:
+            return response
+        seconds = time.perf_counter() - start
+        name = _callbackName(flask.request.get_json(silent=True) or {})
+        size = None if response.direct_passthrough else len(response.get_data())
+        registry.observe('request.' + name, seconds, size=size)
+
+        profile = flask.g.get('energyProfile')
+        if profile is not None:
+            profile.disable()
+            if seconds * 1000 >= PROFILE_MIN_MS:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                filename = f'{time.strftime("%Y%m%d-%H%M%S")}-{int(seconds * 1000)}ms-{name}.prof'
+                profile.dump_stats(os.path.join(PROFILE_DIR, filename))
+        return response
+
+    # Runs after every request, even one whose callback raised, so the
+    # profiler is always stopped and the next request can be profiled
+    @server.teardown_request
+    def stop_profiler(_):
+        profile = flask.g.pop('energyProfile', None)
+        if profile is not None:
+            profile.disable()
+            _profileLock.release()
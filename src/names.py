@@ -0,0 +1,51 @@
+""" This file contains the functions that turn the property and office names
+    found in the Excel files into the canonical names used throughout the
+    dashboard. Names are normalized once, when the files are read in, so the
+    charts and tables never have to clean them again. """
+
+import numpy as np
+import pandas as pd
+
+# Characters that are removed from names, and spaces, which become underscores
+_NICE_TABLE = str.maketrans({'-': None, '.': None, '#': None, '&': None,
+                             '(': None, ')': None, ' ': '_'})
+
+# Names that have already been normalized, shared by every sheet that is read
+_niceCache = dict()
+
+# This function removes possibly dangerous characters
+# INPUT: String
+# OUTPUT: String
+def makeStringsNice(string):
+    string = str(string)
+    string = string.lower().strip().translate(_NICE_TABLE)
+    string = string.replace('__', '_').replace('\'s', '')
+    return string
+
+# Same steps as makeStringsNice, run on a whole column of strings at once
+def _niceSeries(strings):
+    return (strings.str.lower().str.strip().str.translate(_NICE_TABLE)
+            .str.replace('__', '_', regex=False).str.replace('\'s', '', regex=False))
+
+# This function normalizes a column of names. Each distinct name is cleaned
+# once with vectorized string operations and remembered, so repeated names in
+# other sheets and files are only looked up
+# INPUT: Pandas series (or list) of names
+# OUTPUT: Pandas series of normalized names with the same index
+def normalizeNames(values):
+    strings = pd.Series(values, dtype=object).astype(str)
+    codes, uniques = pd.factorize(strings)
+    missing = [name for name in uniques if name not in _niceCache]
+    if missing:
+        _niceCache.update(zip(missing, _niceSeries(pd.Series(missing, dtype=object))))
+    cleaned = np.array([_niceCache[name] for name in uniques], dtype=object)
+    return pd.Series(cleaned[codes], index=strings.index, dtype=object)
+
+# This function interns a column of normalized names: every distinct name gets
+# an integer id, its position in the sorted list of names. Missing names get -1
+# INPUT: Pandas series of names
+# OUTPUT: Numpy array of ids; sorted list of the distinct names
+def internNames(values):
+    names = sorted(pd.Series(values).dropna().unique())
+    ids = pd.Index(names).get_indexer(values)
+    return ids, names
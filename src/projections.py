@@ -0,0 +1,120 @@
+""" This file projects usage and spending for the months after the last one in
+    the data. Every property or office gets its own seasonal trend model,
+
+        value(t) = a + b t + sum over k of (c_k cos(2 pi k m / 12) + d_k sin(2 pi k m / 12))
+
+    where t is the time in years and m the calendar month, fitted by least
+    squares to the months it has data for. All of the models for a matrix
+    are fitted at once: the normal equations of every row are built with one
+    einsum, weighted by which months the row has data for, and solved as one
+    batch, so refitting thousands of properties takes a few milliseconds.
+    Projections are kept per snapshot of the data, like the matrices. """
+
+import numpy as np
+import pandas as pd
+from src.facts import PERIOD_LABEL_FORMAT, readOnly
+from src.metrics import timedStage
+
+# Number of months projected past the end of the data
+PROJECTION_MONTHS = 12
+
+# Ridge added to the normal equations so rows with few months still solve
+RIDGE = 1e-6
+
+# This function picks how many seasonal harmonics the data can support: two
+# (a yearly and a half-yearly cycle) with at least 18 months, one with at
+# least 8, and none (a straight line) below that
+def harmonicsFor(months):
+    if months >= 18:
+        return 2
+    if months >= 8:
+        return 1
+    return 0
+
+# This function builds the model's design matrix for some months
+# INPUT: PeriodIndex of months; month the trend is measured from; number of
+#        harmonics
+# OUTPUT: Array of months x coefficients
+def designMatrix(periods, origin, harmonics):
+    ordinal = (periods.year * 12 + periods.month - 1).to_numpy()
+    t = (ordinal - origin) / 12.0
+    month = (periods.month - 1).to_numpy()
+    columns = [np.ones(len(periods)), t]
+    for k in range(1, harmonics + 1):
+        angle = 2 * np.pi * k * month / 12.0
+        columns += [np.cos(angle), np.sin(angle)]
+    return np.column_stack(columns)
+
+# The fitted models of a matrix and their projections
+class Projection:
+    def __init__(self, entities, periods, values, coefficients, residualStd):
+        self.entities = tuple(entities)
+        self.rowOf = {name: row for row, name in enumerate(self.entities)}
+        # Projected months and their labels, like 'Jan_2024'
+        self.periods = periods
+        self.labels = tuple(periods.strftime(PERIOD_LABEL_FORMAT))
+        # Entities x projected months; NaN for rows with too few months to fit
+        self.values = readOnly(values)
+        self.coefficients = readOnly(coefficients)
+        self.residualStd = readOnly(residualStd)
+
+    # This method returns one name's projection as a read-only view
+    def row(self, name):
+        return self.values[self.rowOf[name]]
+
+# This function fits every row of a values matrix at once
+# INPUT: Array of entities x months (NaN where a row has no data); PeriodIndex
+#        of the months
+# OUTPUT: Coefficients (entities x coefficients, NaN for rows that could not
+#         be fitted); residual standard deviation of each row; the origin
+#         and number of harmonics used
+def fitSeasonalTrend(values, periods):
+    observed = ~np.isnan(values)
+    harmonics = harmonicsFor(len(periods))
+    origin = periods[0].year * 12 + periods[0].month - 1
+    X = designMatrix(periods, origin, harmonics)
+    coefficientCount = X.shape[1]
+
+    weights = observed.astype(float)
+    Y = np.where(observed, values, 0.0)
+    normal = np.einsum('tp,et,tq->epq', X, weights, X, optimize=True)
+    normal += RIDGE * np.eye(coefficientCount)
+    rhs = np.einsum('tp,et->ep', X, Y, optimize=True)
+
+    # A row needs more months than coefficients to be fitted
+    counts = observed.sum(axis=1)
+    fitted = counts > coefficientCount
+    coefficients = np.full((len(values), coefficientCount), np.nan)
+    if fitted.any():
+        coefficients[fitted] = np.linalg.solve(normal[fitted], rhs[fitted][..., None])[..., 0]
+
+    residuals = np.where(observed, Y - coefficients @ X.T, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        residualStd = np.sqrt((residuals ** 2).sum(axis=1) / (counts - coefficientCount))
+    residualStd[~fitted] = np.nan
+    return coefficients, residualStd, origin, harmonics
+
+# This function projects every row of an EntityMatrix. Usage and spending
+# cannot be negative, so projections are floored at 0
+# OUTPUT: Projection
+@timedStage('projections.fit', rows=lambda projection: len(projection.entities))
+def projectMatrix(matrix, months=PROJECTION_MONTHS):
+    coefficients, residualStd, origin, harmonics = fitSeasonalTrend(matrix.values, matrix.periods)
+    future = pd.period_range(matrix.periods[-1] + 1, periods=months, freq='M')
+    values = np.maximum(coefficients @ designMatrix(future, origin, harmonics).T, 0.0)
+    return Projection(matrix.entities, future, values, coefficients, residualStd)
+
+# This function returns the snapshot's projection for one commodity, metric,
+# and grouping, fitting it the first time it is asked for
+def projection(snapshot, commodity, metric, officeOrProp):
+    return snapshot.cached(('projection', commodity, metric, officeOrProp),
+                           lambda: projectMatrix(snapshot.matrix(commodity, metric, officeOrProp)))
+
+# This function returns the projections for the rows of a selection (see
+# Snapshot.selection). When the snapshot's matrices are kept in memory the
+# full projection is fitted once and kept; otherwise only the selected rows
+# are fitted, which gives the same values since every row is fitted on its own
+def selectionProjection(snapshot, commodity, metric, officeOrProp, selection):
+    if snapshot.backend.inMemory:
+        return projection(snapshot, commodity, metric, officeOrProp)
+    return projectMatrix(selection)
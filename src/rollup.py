@@ -0,0 +1,123 @@
+""" This file rolls the energy data up the property -> office -> county
+    hierarchy. For each commodity it builds, in one pass over the fact
+    table, a cube with one layer per metric (usage and spending), one row
+    per property, and one column per month. Each property is mapped to an
+    integer office code once, and the office and county levels are group
+    sums of the cube over those codes (np.add.at) rather than joins and
+    pivots on names. The matrices of every grouping (see Snapshot.matrix in
+    store.py) are slices of these cubes.
+
+    When only the propertyNamesAndOffices file changes, remap() keeps the
+    property and county levels and sums again just the offices that gained
+    or lost a property; every other office's rows are copied over. """
+
+import numpy as np
+import pandas as pd
+from src.facts import COUNTY, METRIC_COLUMNS, EntityMatrix, officeLookup, readOnly
+from src.metrics import timedStage
+
+# Metrics in the order of the cubes' layers
+METRICS = tuple(METRIC_COLUMNS)
+
+# This function maps each property to its office
+# INPUT: Tuple of property names; propNamesAndOffices dataframe
+# OUTPUT: Array of office codes, one per property (-1 for a property without
+#         an office); tuple of the offices, in name order, that codes index
+def officeCodes(properties, propNamesAndOffices):
+    names = officeLookup(propNamesAndOffices).reindex(list(properties))
+    codes, offices = pd.factorize(names, sort=True)
+    return codes.astype(np.intp), tuple(str(office) for office in offices)
+
+# This function adds the rows of a cube (metrics x rows x months) into groups
+# INPUT: Cube with months without data as 0; group code of each row (-1 for
+#        none); number of groups; rows to add, all of them by default
+# OUTPUT: Cube of metrics x groups x months
+def groupSums(cube, codes, groupCount, rows=None):
+    rows = np.flatnonzero(codes >= 0) if rows is None else rows[codes[rows] >= 0]
+    sums = np.zeros((cube.shape[0], groupCount, cube.shape[2]))
+    for layer in range(cube.shape[0]):
+        np.add.at(sums[layer], codes[rows], cube[layer, rows])
+    return sums
+
+# One commodity's data at the property, office, and county levels
+class Rollup:
+    def __init__(self, properties, periods, propertyCube, codes, offices, officeCube, countyCube, officeMonths=None):
+        self.properties = tuple(properties)
+        self.periods = periods
+        # Metrics x properties x months, NaN for months outside the files a
+        # property appears in
+        self.propertyCube = readOnly(propertyCube)
+        self.codes = readOnly(codes)
+        self.offices = offices
+        # Metrics x offices x months and metrics x 1 x months, 0 for months
+        # without bills
+        self.officeCube = readOnly(officeCube)
+        self.countyCube = readOnly(countyCube)
+        # Months that any property with an office has data for. They are
+        # found from the whole property cube unless they are given (e.g. by a
+        # bundle, see bundle.py)
+        if officeMonths is None:
+            present = ~np.isnan(self.propertyCube[0])
+            officeMonths = present[self.codes >= 0].any(axis=0)
+        self.officeMonths = readOnly(np.asarray(officeMonths, dtype=bool))
+
+    # This method returns a new Rollup for a changed property -> office
+    # mapping. Offices none of whose properties moved keep their rows
+    # OUTPUT: Rollup
+    @timedStage('ingest.rollup_remap', rows=lambda rollup: len(rollup.offices))
+    def remap(self, propNamesAndOffices):
+        codes, offices = officeCodes(self.properties, propNamesAndOffices)
+        before = np.array([self.offices[c] if c >= 0 else None for c in self.codes], dtype=object)
+        after = np.array([offices[c] if c >= 0 else None for c in codes], dtype=object)
+        moved = before != after
+        touched = (set(before[moved]) | set(after[moved])) - {None}
+
+        previousRow = {office: row for row, office in enumerate(self.offices)}
+        stale = [row for row, office in enumerate(offices) if office in touched or office not in previousRow]
+        kept = sorted(set(range(len(offices))) - set(stale))
+
+        officeCube = np.zeros((len(METRICS), len(offices), len(self.periods)))
+        officeCube[:, kept] = self.officeCube[:, [previousRow[offices[row]] for row in kept]]
+        if stale:
+            members = np.flatnonzero(np.isin(codes, stale))
+            sums = groupSums(np.nan_to_num(self.propertyCube[:, members]), codes[members], len(offices))
+            officeCube[:, stale] = sums[:, stale]
+        return Rollup(self.properties, self.periods, self.propertyCube, codes, offices, officeCube, self.countyCube)
+
+    # This method returns the matrix of one metric ('usage' or 'spending') for
+    # one grouping ('Property_Name', 'Office', or 'County'). Property rows
+    # keep NaN for months outside their files, offices and the county show 0
+    # for months without bills, and offices only have the months that any of
+    # their properties have data for
+    # OUTPUT: EntityMatrix
+    def matrix(self, metric, grouping):
+        layer = METRICS.index(metric)
+        if grouping == 'Property_Name':
+            return EntityMatrix(self.properties, self.periods, self.propertyCube[layer])
+        if grouping == 'Office':
+            values = self.officeCube[layer]
+            if not self.officeMonths.all():
+                values = values[:, self.officeMonths]
+            return EntityMatrix(self.offices, self.periods[self.officeMonths], values)
+        return EntityMatrix([COUNTY], self.periods, self.countyCube[layer])
+
+# This function builds one commodity's Rollup from the fact table
+# INPUT: Fact table; commodity ('electricity' or 'gas'); propNamesAndOffices
+#        dataframe
+# OUTPUT: Rollup
+@timedStage('ingest.rollup', rows=lambda rollup: rollup.propertyCube.size)
+def buildRollup(facts, commodity, propNamesAndOffices):
+    rows = facts[facts['commodity'] == commodity]
+    rowIndex, properties = pd.factorize(rows['property'], sort=True)
+    columnIndex, periods = pd.factorize(rows['period'], sort=True)
+    properties = [str(p) for p in properties]
+
+    propertyCube = np.full((len(METRICS), len(properties), len(periods)), np.nan)
+    for layer, metric in enumerate(METRICS):
+        propertyCube[layer, rowIndex, columnIndex] = rows[METRIC_COLUMNS[metric]].to_numpy(np.float64)
+    filled = np.nan_to_num(propertyCube)
+
+    codes, offices = officeCodes(properties, propNamesAndOffices)
+    officeCube = groupSums(filled, codes, len(offices))
+    countyCube = filled.sum(axis=1, keepdims=True)
+    return Rollup(properties, pd.PeriodIndex(periods), propertyCube, codes, offices, officeCube, countyCube)
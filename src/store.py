@@ -0,0 +1,379 @@
+""" This file contains the data store that the dashboard reads its data from.
+    Creating the store does not read anything. The workbooks are parsed and
+    the fact table is built the first time any data is asked for, and each
+    (commodity, metric, grouping) matrix and dataframe is built from the fact
+    table the first time it is used and kept after that. warm() does all of
+    this up front, optionally in a background thread, so that the web server
+    can start serving while the data is still loading.
+
+    All of the data lives in a Snapshot. When a workbook changes, reload()
+    builds a new snapshot that reuses everything the change did not touch and
+    then swaps it in with a single assignment. A callback that needs more
+    than one dataframe should take store.snapshot once and read from it, so
+    it sees one consistent version of the data even if a reload happens in
+    the meantime. Snapshots are read-only: callbacks must build new arrays
+    or dataframes rather than change the ones they are given.
+
+    Callbacks read the rows they show with Snapshot.selection, through the
+    store's backend (see backends.py), which picks them out of the matrices
+    in memory or queries them from an SQLite database.
+
+    When a data bundle built by python -m src.build from the current
+    workbooks exists (see bundle.py), the first snapshot is opened from it
+    instead of being ingested, with its arrays memory-mapped. Its facts are
+    read from the bundle only when something asks for them. Such a snapshot
+    has no parsed workbooks, so the first reload after a workbook changes
+    parses all of them.
+
+    The store can be indexed like the all_data_dict dictionary it replaces:
+
+        store['electricity', 'usage', 'Property_Name'] """
+
+import logging
+import os
+import threading
+import time
+import pandas as pd
+import src.functions as fcns
+from src.backends import MemoryBackend, makeBackend
+from src.bundle import BUNDLE_DIR, openBundle
+from src.facts import (COMMODITY_UNITS, GROUPINGS, METRIC_COLUMNS, PERIOD_LABEL_FORMAT, combineFacts, commodityFacts,
+                       readOnlyFrame)
+from src.loader import DATA_DIR, HISTORY_YEARS, OFFICES_FILE, discoverWorkbooks, neededWorkbooks
+from src.metrics import registry, timedStage
+from src.rollup import buildRollup
+
+logger = logging.getLogger(__name__)
+
+# Every (commodity, metric, grouping) view of the data
+VIEW_KEYS = [(c, m, g) for c in COMMODITY_UNITS for m in METRIC_COLUMNS for g in GROUPINGS]
+
+# Kinds of derived data that depend only on one commodity, metric, and
+# grouping, and so can be carried over to the next snapshot when those did
+# not change
+PER_VIEW_KINDS = ('matrix', 'view', 'table', 'projection')
+
+# One consistent version of the data. Apart from the derived data (matrices,
+# views, ...), which is built on first use, nothing in a snapshot changes
+# after it is built: name lists are tuples and the arrays behind the fact
+# table, the propNamesAndOffices dataframe, the matrices, views, and other
+# derived data are read-only (see readOnly and readOnlyFrame in facts.py).
+# Callbacks get views of those arrays rather than copies, so any number of
+# requests can read a snapshot at once without locks
+class Snapshot:
+    def __init__(self, version, files, bills, factsByCommodity, propNamesAndOffices, derived=None, backend=None):
+        self.version = version
+        self.backend = backend or MemoryBackend()
+        # Workbook -> file processed using readEnergyExcelFiles
+        self.files = files
+        # Workbook -> yearly bills dataframe
+        self.bills = bills
+        # Commodity -> that commodity's facts, before offices are attached,
+        # or a function that reads them (see bundle.py)
+        self._factsByCommodity = {commodity: facts if callable(facts) else readOnlyFrame(facts)
+                                  for commodity, facts in factsByCommodity.items()}
+        self.propNamesAndOffices = readOnlyFrame(propNamesAndOffices)
+        self._derived = dict(derived or {})
+        self._lock = threading.RLock()
+
+        # Files for each commodity, in chronological order
+        self.energyFiles = {c: [files[w] for w in sorted(files, key=lambda w: w.year) if w.commodity == c]
+                            for c in COMMODITY_UNITS}
+        # Sorted Cook County facilities and offices
+        self.properties = tuple(sorted(propNamesAndOffices['Property_Name'].unique()))
+        self.offices = tuple(sorted(propNamesAndOffices['Office'].unique()))
+        # Every month in the data, in chronological order. A commodity's
+        # rollup, when there already is one, has the same months as its facts
+        periods = pd.concat([pd.Series(self._derived[('rollup', c)].periods) if ('rollup', c) in self._derived
+                             else self.commodityFacts(c)['period'] for c in factsByCommodity])
+        self.dates = tuple(periods.drop_duplicates().sort_values().dt.strftime(PERIOD_LABEL_FORMAT))
+
+    # This method returns one commodity's facts, reading them the first time
+    # they are asked for when they are not in memory
+    def commodityFacts(self, commodity):
+        facts = self._factsByCommodity[commodity]
+        if callable(facts):
+            return self.cached(('facts', commodity), lambda: readOnlyFrame(facts()))
+        return facts
+
+    # Commodity -> that commodity's facts
+    @property
+    def factsByCommodity(self):
+        return {commodity: self.commodityFacts(commodity) for commodity in self._factsByCommodity}
+
+    # The fact table of both commodities with each property's office
+    # attached, built the first time it is used
+    @property
+    def facts(self):
+        return self.cached(('facts',),
+                           lambda: readOnlyFrame(combineFacts(self.factsByCommodity, self.propNamesAndOffices)))
+
+    # This method returns data derived from this snapshot, building it with
+    # build() the first time the key is asked for and keeping it after that
+    def cached(self, key, build):
+        value = self._derived.get(key)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(key)
+                if value is None:
+                    value = build()
+                    self._derived[key] = value
+        return value
+
+    # This method returns one commodity's data rolled up from properties to
+    # offices and the county (see rollup.py)
+    def rollup(self, commodity):
+        return self.cached(('rollup', commodity),
+                           lambda: buildRollup(self.facts, commodity, self.propNamesAndOffices))
+
+    # This method returns the EntityMatrix (see facts.py) for one commodity
+    # ('electricity' or 'gas'), metric ('usage' or 'spending'), and grouping
+    # ('Property_Name', 'Office', or 'County')
+    def matrix(self, commodity, metric, grouping):
+        return self.cached(('matrix', commodity, metric, grouping),
+                           lambda: self.rollup(commodity).matrix(metric, grouping))
+
+    # This method returns the rows of the given offices or properties, with
+    # every month, read through the snapshot's backend
+    # OUTPUT: EntityMatrix
+    def selection(self, commodity, metric, grouping, names):
+        return self.backend.selection(self, commodity, metric, grouping, names)
+
+    # This method returns every office or property (or the county) that has
+    # data for a commodity, read through the snapshot's backend
+    def names(self, commodity, grouping):
+        return self.backend.names(self, commodity, grouping)
+
+    # This method returns the same data as matrix() as a wide dataframe
+    def view(self, commodity, metric, grouping):
+        return self.cached(('view', commodity, metric, grouping),
+                           lambda: self.matrix(commodity, metric, grouping).toFrame(grouping))
+
+    def __getitem__(self, key):
+        return self.view(*key)
+
+    def keys(self):
+        return list(VIEW_KEYS)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    # Derived data that is already built and can be reused by the next
+    # snapshot if the data behind it did not change
+    def builtData(self):
+        return dict(self._derived)
+
+class DataStore:
+    def __init__(self, dataDir=DATA_DIR, officesFile=OFFICES_FILE, historyYears=HISTORY_YEARS, backend=None,
+                 bundleDir=BUNDLE_DIR):
+        self.backend = backend or makeBackend()
+        self.dataDir = dataDir
+        self.officesFile = officesFile
+        self.historyYears = historyYears
+        # Folder of the data bundles, or None to always ingest the workbooks
+        self.bundleDir = bundleDir
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._warmThread = None
+        self._reloadListeners = list()
+
+    # This method registers a function that is called with the new snapshot
+    # every time reload() or rebuild() swaps one in
+    def onReload(self, listener):
+        self._reloadListeners.append(listener)
+
+    def _notify(self, snapshot):
+        for listener in self._reloadListeners:
+            listener(snapshot)
+
+    # The current snapshot, loading the data the first time it is asked for
+    @property
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._open() or self._build(None, set())
+                snapshot = self._snapshot
+        return snapshot
+
+    # Paths of the workbooks and the propertyNamesAndOffices file the data is
+    # built from
+    def sourcePaths(self):
+        workbooks = neededWorkbooks(discoverWorkbooks(self.dataDir), self.historyYears)
+        return [w.path for w in workbooks] + [self.officesFile]
+
+    # This method opens the first snapshot from the current data bundle
+    # OUTPUT: Snapshot, or None if there is no bundle for the current files
+    def _open(self):
+        if self.bundleDir is None:
+            return None
+        bundle = openBundle(self.sourcePaths(), self.bundleDir)
+        if bundle is None:
+            return None
+        derived = {('rollup', commodity): rollup for commodity, rollup in bundle['rollups'].items()}
+        snapshot = Snapshot(1, dict(), dict(), bundle['factsByCommodity'], bundle['propNamesAndOffices'],
+                            derived, self.backend)
+        self.backend.write(snapshot)
+        return snapshot
+
+    # This method builds a new snapshot. Workbooks that are new or whose paths
+    # are in changedPaths are parsed again and their commodity's facts are
+    # rebuilt; everything else, including views of untouched commodities, is
+    # taken from the previous snapshot
+    @timedStage('ingest.snapshot_build', rows=lambda snapshot: sum(len(f) for f in snapshot.factsByCommodity.values()))
+    def _build(self, previous, changedPaths):
+        workbooks = neededWorkbooks(discoverWorkbooks(self.dataDir), self.historyYears)
+        if previous is None:
+            stale = list(workbooks)
+            removed = list()
+        else:
+            stale = [w for w in workbooks if w not in previous.files or os.path.abspath(w.path) in changedPaths]
+            removed = [w for w in previous.files if w not in workbooks]
+
+        files = dict() if previous is None else {w: previous.files[w] for w in workbooks if w in previous.files}
+        bills = dict() if previous is None else {w: previous.bills[w] for w in workbooks if w in previous.bills}
+        for w, excFile in fcns.readWorkbooks(stale).items():
+            files[w] = excFile
+            bills[w] = fcns.mergeMonthsSheetsToYear(fcns.addMonthsDataToList(excFile, COMMODITY_UNITS[w.commodity]))
+
+        touched = {w.commodity for w in stale + removed}
+        factsByCommodity = dict()
+        for commodity in COMMODITY_UNITS:
+            if previous is not None and commodity not in touched:
+                factsByCommodity[commodity] = previous.commodityFacts(commodity)
+            else:
+                yearDfs = [bills[w] for w in sorted(bills, key=lambda w: w.year) if w.commodity == commodity]
+                factsByCommodity[commodity] = commodityFacts(yearDfs)
+
+        mappingChanged = previous is None or os.path.abspath(self.officesFile) in changedPaths
+        if mappingChanged:
+            propNamesAndOffices = fcns.loadPropNamesAndOffices(self.officesFile)
+        else:
+            propNamesAndOffices = previous.propNamesAndOffices
+
+        derived = dict()
+        if previous is not None:
+            built = previous.builtData()
+            derived = {key: value for key, value in built.items()
+                       if key[0] in PER_VIEW_KINDS and key[1] not in touched
+                       and not (mappingChanged and key[3] == 'Office')}
+            # A new office mapping only changes the offices whose properties
+            # moved, so the rollup is remapped rather than built again
+            for commodity in COMMODITY_UNITS:
+                rollup = built.get(('rollup', commodity))
+                if rollup is not None and commodity not in touched:
+                    derived[('rollup', commodity)] = rollup.remap(propNamesAndOffices) if mappingChanged else rollup
+        version = 1 if previous is None else previous.version + 1
+        snapshot = Snapshot(version, files, bills, factsByCommodity, propNamesAndOffices, derived, self.backend)
+        self.backend.write(snapshot)
+        return snapshot
+
+    # This method re-ingests only what changed. changedPaths are the paths of
+    # workbooks (or the propertyNamesAndOffices file) that were added, changed,
+    # or removed. The new snapshot is swapped in once it is complete
+    # OUTPUT: Seconds taken
+    def reload(self, changedPaths):
+        start = time.perf_counter()
+        changedPaths = {os.path.abspath(p) for p in changedPaths}
+        with self._lock:
+            previous = self._snapshot
+            snapshot = self._build(previous, changedPaths)
+            self._snapshot = snapshot
+        self._notify(snapshot)
+        elapsed = time.perf_counter() - start
+        names = ', '.join(sorted(os.path.basename(p) for p in changedPaths))
+        logger.info('Reloaded %s into data version %d in %.2fs', names, snapshot.version, elapsed)
+        return elapsed
+
+    # This method rebuilds all of the data from scratch and swaps it in
+    # OUTPUT: Seconds taken
+    def rebuild(self):
+        start = time.perf_counter()
+        with self._lock:
+            previous = self._snapshot
+            snapshot = self._build(None, set())
+            if previous is not None:
+                snapshot.version = previous.version + 1
+            self._snapshot = snapshot
+        self._notify(snapshot)
+        elapsed = time.perf_counter() - start
+        logger.info('Rebuilt all data into data version %d in %.2fs', snapshot.version, elapsed)
+        return elapsed
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    @property
+    def energyFiles(self):
+        return self.snapshot.energyFiles
+
+    @property
+    def propNamesAndOffices(self):
+        return self.snapshot.propNamesAndOffices
+
+    @property
+    def facts(self):
+        return self.snapshot.facts
+
+    @property
+    def properties(self):
+        return self.snapshot.properties
+
+    @property
+    def offices(self):
+        return self.snapshot.offices
+
+    @property
+    def dates(self):
+        return self.snapshot.dates
+
+    def view(self, commodity, metric, grouping):
+        return self.snapshot.view(commodity, metric, grouping)
+
+    def matrix(self, commodity, metric, grouping):
+        return self.snapshot.matrix(commodity, metric, grouping)
+
+    def __getitem__(self, key):
+        return self.view(*key)
+
+    def keys(self):
+        return list(VIEW_KEYS)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return self.snapshot.items()
+
+    # This method loads the data and, when the backend reads from memory,
+    # builds every view. With background=True the work runs in a daemon
+    # thread and the method returns straight away
+    def warm(self, background=False):
+        def build():
+            snapshot = self.snapshot
+            if self.backend.inMemory:
+                snapshot.items()
+        if not background:
+            build()
+            return None
+        with self._lock:
+            if self._warmThread is None:
+                self._warmThread = threading.Thread(target=build, name='data-store-warm', daemon=True)
+                self._warmThread.start()
+        return self._warmThread
+
+    # The version of the data if it has been loaded, or 0, without loading it
+    @property
+    def loadedVersion(self):
+        snapshot = self._snapshot
+        return 0 if snapshot is None else snapshot.version
+
+# The store used by the dashboard
+store = DataStore()
+registry.gauge('energy_data_version', 'Version of the data being served, 0 until it is loaded',
+               lambda: store.loadedVersion)
@@ -0,0 +1,143 @@
+""" This file writes synthetic electricity and gas workbooks laid out like the
+    Cook County ones, so the dashboard can be run and benchmarked without the
+    real data. For each fiscal year it writes originalElectricityYYYY.xlsx
+    and originalGasYYYY.xlsx, each with a non-month sheet followed by one
+    'YYYY-Mon' sheet per month from December of the previous year through
+    November, with the Property_Name, Service_Address, kWh or therms,
+    Total_Amount, and Account_Number columns. It also writes a matching
+    propertyNamesAndOffices.xlsx. The data has the quirks the cleaning code
+    handles: properties with more than one account, missing bills, 'N/A' and
+    empty usage, blank property names, names with punctuation, and
+    properties that open or close part way through the years. Usage follows
+    a seasonal pattern (gas peaks in winter, electricity in summer) with a
+    trend and noise, and spending follows usage at a rate that drifts.
+
+        python -m src.synthetic OUT_DIR --properties 10000 --years 10
+
+    writes OUT_DIR/data/*.xlsx and OUT_DIR/propertyNamesAndOffices.xlsx; run
+    the dashboard from OUT_DIR, or point ENERGY_DATA_DIR and
+    ENERGY_OFFICES_FILE at them. """
+
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+# Unit column, typical monthly usage, price per unit, and how strongly each
+# month of the year (Jan first) scales usage, per commodity
+COMMODITIES = {
+    'Electricity': {'unit': 'kWh', 'usage': 40000.0, 'price': 0.11,
+                    'season': [0.9, 0.85, 0.85, 0.85, 0.95, 1.2, 1.4, 1.4, 1.15, 0.9, 0.85, 0.9]},
+    'Gas': {'unit': 'therms', 'usage': 3000.0, 'price': 0.85,
+            'season': [2.0, 1.8, 1.4, 0.9, 0.5, 0.3, 0.25, 0.25, 0.35, 0.7, 1.3, 1.8]},
+}
+
+_NAME_KINDS = ['Courthouse', 'Health Center', 'Hospital', 'Police Station', 'Warehouse', 'Office Building',
+               'Garage', 'Clinic', 'Forest Preserve Facility', 'Juvenile Center']
+
+# This function makes up property names, some with the punctuation the real
+# names have (apostrophes, periods, '&', '#', parentheses)
+def propertyNames(count, rng):
+    names = list()
+    for i in range(count):
+        kind = _NAME_KINDS[i % len(_NAME_KINDS)]
+        style = rng.integers(5)
+        if style == 0:
+            names.append(f"{kind} #{i}")
+        elif style == 1:
+            names.append(f"St. Mary's {kind} {i}")
+        elif style == 2:
+            names.append(f"{kind} {i} & Annex")
+        elif style == 3:
+            names.append(f"{kind} ({i})")
+        else:
+            names.append(f"{kind} {i}")
+    return names
+
+# This function writes the workbooks and the propertyNamesAndOffices file
+# INPUT: Output folder; number of properties, offices, and fiscal years; last
+#        fiscal year; random seed
+# OUTPUT: List of the paths written
+def generate(outDir, properties=500, offices=40, years=3, lastYear=2023, seed=0):
+    rng = np.random.default_rng(seed)
+    dataDir = os.path.join(outDir, 'data')
+    os.makedirs(dataDir, exist_ok=True)
+    names = np.array(propertyNames(properties, rng), dtype=object)
+    firstYear = lastYear - years + 1
+
+    # Each property belongs to one office, has one or more accounts, a size,
+    # a yearly trend, and the fiscal years it is open
+    office = rng.integers(offices, size=properties)
+    accounts = 1 + (rng.random(properties) < 0.15) + (rng.random(properties) < 0.03)
+    size = rng.lognormal(0.0, 0.8, size=properties)
+    trend = rng.normal(0.0, 0.03, size=properties)
+    opens = np.where(rng.random(properties) < 0.1, rng.integers(firstYear, lastYear + 1, size=properties), firstYear)
+    closes = np.where(rng.random(properties) < 0.05, rng.integers(firstYear, lastYear + 1, size=properties), lastYear)
+    closes = np.maximum(opens, closes)
+
+    paths = list()
+    mapping = pd.DataFrame({'Property_Name': names, 'Office': [f'Office {o + 1}' for o in office]})
+    path = os.path.join(outDir, 'propertyNamesAndOffices.xlsx')
+    mapping.to_excel(path, index=False)
+    paths.append(path)
+
+    # One row per account of every property
+    rowProperty = np.repeat(np.arange(properties), accounts)
+    rowAccount = np.concatenate([np.arange(a) for a in accounts])
+    accountNumbers = 10**9 + rowProperty * 10 + rowAccount
+    addresses = np.array([f'{100 + p} W Washington St' for p in rowProperty], dtype=object)
+
+    for year in range(firstYear, lastYear + 1):
+        open_ = (opens[rowProperty] <= year) & (closes[rowProperty] >= year)
+        for commodity, spec in COMMODITIES.items():
+            sheets = {'Summary': pd.DataFrame({'Fiscal_Year': [year], 'Properties': [int(open_.sum())]})}
+            price = spec['price'] * (1 + 0.03 * (year - firstYear))
+            for sheetYear, month in [(year - 1, 11)] + [(year, m) for m in range(11)]:
+                rows = open_ & (rng.random(len(rowProperty)) > 0.02)
+                t = (sheetYear - firstYear) + month / 12
+                usage = (spec['usage'] * size[rowProperty] * spec['season'][month] / accounts[rowProperty]
+                         * (1 + trend[rowProperty] * t) * rng.normal(1.0, 0.08, size=len(rowProperty)))
+                usage = np.maximum(usage, 0).round(2)
+                spend = (usage * price * rng.normal(1.0, 0.04, size=len(rowProperty)) + 15).round(2)
+
+                usageColumn = usage.astype(object)
+                quirks = rng.random(len(rowProperty))
+                usageColumn[quirks < 0.01] = 'N/A'
+                usageColumn[(quirks >= 0.01) & (quirks < 0.015)] = None
+                nameColumn = names[rowProperty].copy()
+                nameColumn[rng.random(len(rowProperty)) < 0.005] = None
+
+                sheets[f'{sheetYear}-{MONTHS[month]}'] = pd.DataFrame({
+                    'Property_Name': nameColumn[rows],
+                    'Service_Address': addresses[rows],
+                    spec['unit']: usageColumn[rows],
+                    'Total_Amount': spend[rows],
+                    'Account_Number': accountNumbers[rows],
+                })
+
+            path = os.path.join(dataDir, f'original{commodity}{year}.xlsx')
+            with pd.ExcelWriter(path) as writer:
+                for sheet, df in sheets.items():
+                    df.to_excel(writer, sheet_name=sheet, index=False)
+            paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic Cook County energy workbooks')
+    parser.add_argument('out', help='folder to write data/ and propertyNamesAndOffices.xlsx into')
+    parser.add_argument('--properties', type=int, default=500)
+    parser.add_argument('--offices', type=int, default=40)
+    parser.add_argument('--years', type=int, default=3, help='number of fiscal years')
+    parser.add_argument('--last-year', type=int, default=2023, help='last fiscal year')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = generate(args.out, args.properties, args.offices, args.years, args.last_year, args.seed)
+    print(f'Wrote {len(paths)} files to {args.out} in {time.perf_counter() - start:.1f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+""" This file answers the main tab's table one page at a time. The table runs
+    with custom paging, sorting, and filtering, so the browser only ever
+    holds the rows it is showing: the server filters and sorts the selected
+    rows of an EntityMatrix with array operations and sends back one page of
+    records and tooltips. Filters use the DataTable's filter_query syntax,
+    e.g. '{Office} contains "sheriff" && {Jan_2022} > 100'. """
+
+import math
+import numpy as np
+from src.facts import readOnly
+
+# Filter operators as they appear in filter_query, with the spelled-out forms
+# that mean the same thing
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='],
+                    ['contains '], ['datestartswith ']]
+
+_COMPARE = {
+    'ge': np.greater_equal, 'le': np.less_equal, 'lt': np.less,
+    'gt': np.greater, 'ne': np.not_equal, 'eq': np.equal,
+}
+
+# This function returns the matrix's values as the table shows them, rounded
+# to two decimals with months without data shown as 0. It is kept per snapshot
+def tableValues(snapshot, commodity, metric, officeOrProp):
+    def build():
+        values = np.round(snapshot.matrix(commodity, metric, officeOrProp).values.astype(float), 2)
+        return readOnly(np.nan_to_num(values, nan=0.0))
+    return snapshot.cached(('table', commodity, metric, officeOrProp), build)
+
+# This function returns a matrix holding the selected rows and the values the
+# table shows for it. When the snapshot's matrices are kept in memory these
+# are the full matrix and its table values, which are kept per snapshot;
+# otherwise just the selected rows are read and rounded
+# OUTPUT: EntityMatrix; array of its values as the table shows them
+def tableSelection(snapshot, commodity, metric, officeOrProp, names):
+    if snapshot.backend.inMemory:
+        return snapshot.matrix(commodity, metric, officeOrProp), tableValues(snapshot, commodity, metric, officeOrProp)
+    selection = snapshot.selection(commodity, metric, officeOrProp, names)
+    return selection, readOnly(np.nan_to_num(np.round(selection.values, 2), nan=0.0))
+
+# This function splits one part of a filter_query, like '{Jan_2022} > 100'
+# OUTPUT: Column id; operator ('ge', ..., 'contains'); value, or three Nones if
+#         the part cannot be read
+def parseFilterPart(filterPart):
+    for operatorType in FILTER_OPERATORS:
+        for operator in operatorType:
+            if operator in filterPart:
+                namePart, valuePart = filterPart.split(operator, 1)
+                name = namePart[namePart.find('{') + 1: namePart.rfind('}')]
+                valuePart = valuePart.strip()
+                if not valuePart:
+                    return None, None, None
+                quote = valuePart[0]
+                if quote == valuePart[-1] and quote in ("'", '"', '`') and len(valuePart) > 1:
+                    value = valuePart[1:-1].replace('\\' + quote, quote)
+                else:
+                    try:
+                        value = float(valuePart)
+                    except ValueError:
+                        value = valuePart
+                return name, operatorType[0].strip(), value
+    return None, None, None
+
+# This function returns a mask of the rows that pass every part of a
+# filter_query. Parts that cannot be read or name unknown columns are ignored
+# INPUT: filter_query; name column id; array of row names; list of month
+#        labels; array of rows x months
+def filterMask(filterQuery, nameColumn, names, labels, values):
+    mask = np.ones(len(names), dtype=bool)
+    columnOf = {label: column for column, label in enumerate(labels)}
+    for part in (filterQuery or '').split(' && '):
+        column, operator, value = parseFilterPart(part)
+        if column is None:
+            continue
+        if column == nameColumn:
+            text = np.array(names, dtype=object)
+            value = str(value).lower() if operator == 'contains' else str(value)
+            if operator in ('contains', 'datestartswith'):
+                lowered = [n.lower() for n in names] if operator == 'contains' else names
+                test = (lambda n: value in n) if operator == 'contains' else (lambda n: n.startswith(value))
+                mask &= np.fromiter((test(n) for n in lowered), dtype=bool, count=len(names))
+            elif operator in _COMPARE:
+                mask &= _COMPARE[operator](text, value).astype(bool)
+        elif column in columnOf:
+            data = values[:, columnOf[column]]
+            if operator in _COMPARE and isinstance(value, float):
+                mask &= _COMPARE[operator](data, value)
+            elif operator == 'contains':
+                mask &= np.fromiter((str(value) in str(v) for v in data), dtype=bool, count=len(data))
+    return mask
+
+# This function returns the order of the rows for a DataTable sort_by. The
+# last entry of sort_by breaks the fewest ties
+def sortOrder(sortBy, nameColumn, names, labels, values):
+    columnOf = {label: column for column, label in enumerate(labels)}
+    keys = list()
+    for entry in reversed(sortBy or []):
+        column, descending = entry['column_id'], entry['direction'] == 'desc'
+        if column == nameColumn:
+            # Rows are already sorted by name, so their position is the key
+            key = np.arange(len(names))
+        elif column in columnOf:
+            key = values[:, columnOf[column]]
+        else:
+            continue
+        keys.append(-key if descending else key)
+    if not keys:
+        return np.arange(len(names))
+    return np.lexsort(keys)
+
+# This function answers one request of the table
+# INPUT: EntityMatrix; the values it shows (see tableValues); name column id;
+#        names to show; page number and size; sort_by; filter_query
+# OUTPUT: Dictionary with the page's records and tooltips, the number of
+#         pages, the page shown, and the number of rows that passed the filter
+def queryTable(matrix, values, nameColumn, namesToKeep, page, pageSize, sortBy, filterQuery):
+    rows = matrix.rowsFor(namesToKeep or [])
+    names = [matrix.entities[r] for r in rows]
+    selected = values[rows]
+
+    keep = np.flatnonzero(filterMask(filterQuery, nameColumn, names, matrix.labels, selected))
+    names = [names[i] for i in keep]
+    selected = selected[keep]
+    order = sortOrder(sortBy, nameColumn, names, matrix.labels, selected)
+
+    pageCount = max(1, math.ceil(len(order) / pageSize))
+    page = min(max(page or 0, 0), pageCount - 1)
+    pageRows = order[page * pageSize:(page + 1) * pageSize]
+
+    records = list()
+    for i in pageRows:
+        record = {nameColumn: names[i]}
+        record.update(zip(matrix.labels, selected[i].tolist()))
+        records.append(record)
+    tooltips = [{column: {'value': str(value), 'type': 'markdown'} for column, value in record.items()}
+                for record in records]
+    return {'records': records, 'tooltips': tooltips, 'pageCount': pageCount, 'page': page, 'rows': len(order)}
@@ -0,0 +1,120 @@
+""" This file watches the data folder and the propertyNamesAndOffices file
+    while the dashboard is running. When a workbook is added, changed, or
+    removed, the store re-ingests just that workbook and its commodity and
+    swaps in the new data without a restart. The folder is polled, so no
+    extra packages are needed; a file is only reloaded once its size and
+    modification time have stayed the same for one polling interval, so
+    workbooks that are still being written are not read half-finished.
+
+    Under gunicorn only the master process watches (see gunicorn.conf.py).
+    It does not reload from the watcher's thread: requestReload sends it
+    SIGHUP, and gunicorn's on_reload hook calls reloadRequested in its main
+    thread, which reloads the store once before gunicorn forks a new set of
+    workers from it and stops the old ones. The workers then share the new
+    data copy-on-write, as they shared the data loaded at startup. """
+
+import logging
+import os
+import signal
+import threading
+from src.loader import WORKBOOK_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the data folder, set ENERGY_WATCH_INTERVAL=0 to
+# turn the watcher off
+WATCH_INTERVAL = float(os.environ.get('ENERGY_WATCH_INTERVAL', '5'))
+
+# Paths the watcher found changed that requestReload has not had reloaded yet
+_requested = set()
+_requestedLock = threading.Lock()
+
+# This function asks the gunicorn master to reload the given paths. It is
+# passed to the master's DataWatcher in place of store.reload
+def requestReload(paths):
+    with _requestedLock:
+        _requested.update(paths)
+    os.kill(os.getpid(), signal.SIGHUP)
+
+# This function reloads the paths passed to requestReload, then calls
+# prepare() so everything the workers read can be built from the new data
+# before they are forked. It runs in gunicorn's on_reload hook
+# OUTPUT: List of paths that were reloaded
+def reloadRequested(store, prepare=None):
+    with _requestedLock:
+        paths = sorted(_requested)
+        _requested.clear()
+    if not paths:
+        return []
+    try:
+        store.reload(paths)
+    except Exception:
+        logger.exception('Could not reload %s; keeping the current data', ', '.join(paths))
+        return []
+    if prepare is not None:
+        prepare()
+    return paths
+
+# Polls the files the store reads and calls reload (store.reload by default)
+# with the paths that changed
+class DataWatcher:
+    def __init__(self, store, interval=WATCH_INTERVAL, reload=None):
+        self.store = store
+        self.interval = interval
+        self.reload = reload or store.reload
+        self._stop = threading.Event()
+        self._thread = None
+        self._seen = self._scan()
+
+    # Size and modification time of every file the store reads
+    def _scan(self):
+        paths = [os.path.abspath(self.store.officesFile)]
+        try:
+            paths += [os.path.abspath(os.path.join(self.store.dataDir, f))
+                      for f in os.listdir(self.store.dataDir) if WORKBOOK_PATTERN.match(f)]
+        except OSError:
+            pass
+        stats = dict()
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stats[path] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    # This method compares the files against the last scan and reloads the
+    # store if any of them changed and have stopped changing
+    # OUTPUT: List of paths that were reloaded
+    def check(self):
+        current = self._scan()
+        changed = {p for p in set(current) | set(self._seen) if current.get(p) != self._seen.get(p)}
+        if not changed:
+            return []
+        # Wait until every changed file has the same size and modification
+        # time in two scans in a row
+        self._stop.wait(self.interval)
+        settled = self._scan()
+        if any(settled.get(p) != current.get(p) for p in changed):
+            return []
+        try:
+            self.reload(changed)
+        except Exception:
+            logger.exception('Could not reload %s; keeping the current data', ', '.join(sorted(changed)))
+            return []
+        finally:
+            self._seen = settled
+        return sorted(changed)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='data-watcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
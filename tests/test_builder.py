@@ -0,0 +1,72 @@
+""" This file checks that the dataframes built by functions.py from the fact
+    table match the ones the original pipeline built, which merged every
+    month's dataframe into the year with a chain of outer merges. The
+    original pipeline is kept unchanged in legacy_functions.py, and both run
+    on synthetic workbooks written by src/synthetic.py:
+
+        python -m pytest tests
+
+    The county totals, which the original pipeline did not have, are checked
+    against the sum of every property's row.
+
+    Rows are compared by name and columns by month label, so the checks do
+    not depend on the order in which either pipeline produces them. Usage and
+    spending are stored as float32 in the fact table, so values are compared
+    with a relative tolerance of 1e-6. """
+
+import importlib.util
+import os
+import numpy as np
+import pytest
+import src.functions as fcns
+from src.backends import MemoryBackend
+from src.store import DataStore
+from src.synthetic import generate
+
+LEGACY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'legacy_functions.py')
+
+# The original pipeline reads the 2021, 2022, and 2023 workbooks from the
+# folder it runs in and shows 2022 and 2023, so the store loads the last two
+# fiscal years of the same workbooks
+@pytest.fixture(scope='module')
+def pipelines(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('synthetic')
+    generate(str(folder), properties=60, offices=8, years=3, lastYear=2023)
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        spec = importlib.util.spec_from_file_location('legacy_functions', LEGACY)
+        legacy = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(legacy)
+        store = DataStore(str(folder / 'data'), str(folder / 'propertyNamesAndOffices.xlsx'), 2,
+                          backend=MemoryBackend(), bundleDir=None)
+        snapshot = store.snapshot
+    finally:
+        os.chdir(cwd)
+    return legacy, snapshot
+
+# This function sorts a wide dataframe's rows by name
+def byName(df, officeOrProp):
+    return df.set_index(officeOrProp).sort_index()
+
+@pytest.mark.parametrize('gasOrElec', ['electricity', 'gas'])
+@pytest.mark.parametrize('officeOrProp', ['Property_Name', 'Office'])
+@pytest.mark.parametrize('frame', ['total', 'usage', 'spending'])
+def test_matches_legacy_pipeline(pipelines, gasOrElec, officeOrProp, frame):
+    legacy, snapshot = pipelines
+    expected = byName(legacy.aggregateYears(gasOrElec, officeOrProp)[frame], officeOrProp)
+    actual = byName(fcns.aggregateCommodity(gasOrElec, snapshot)[officeOrProp][frame], officeOrProp)
+
+    assert list(actual.index) == list(expected.index)
+    assert sorted(actual.columns) == sorted(expected.columns)
+    np.testing.assert_allclose(actual[expected.columns].to_numpy(float), expected.to_numpy(float), rtol=1e-6)
+
+@pytest.mark.parametrize('gasOrElec', ['electricity', 'gas'])
+@pytest.mark.parametrize('metric', ['usage', 'spending'])
+def test_county_is_sum_of_properties(pipelines, gasOrElec, metric):
+    _, snapshot = pipelines
+    properties = byName(snapshot[gasOrElec, metric, 'Property_Name'], 'Property_Name')
+    county = byName(snapshot[gasOrElec, metric, 'County'], 'County')
+
+    assert list(county.columns) == list(properties.columns)
+    np.testing.assert_allclose(county.iloc[0].to_numpy(float), properties.sum().to_numpy(float), rtol=1e-6)
@@ -0,0 +1,54 @@
+""" This file is the production entry point of the dashboard. It creates the
+    app, loads all of the data, and (with the memory backend, see
+    backends.py) builds every matrix, view, table, projection, and anomaly
+    scan the callbacks read, then exposes the Flask server for a WSGI server:
+
+        gunicorn wsgi:server
+
+    With gunicorn.conf.py (preload_app) this module is imported once in the
+    master process before the workers are forked, so the data is parsed once
+    and the workers share its arrays copy-on-write instead of each holding a
+    copy. With a data bundle built by python -m src.build (see bundle.py),
+    the data is opened memory-mapped rather than parsed. When the master
+    reloads changed workbooks, preload() runs again before it forks the new
+    workers. """
+
+import gc
+import logging
+import time
+from main import create_app
+from src.anomalies import anomalyScan
+from src.averages import averagesCube
+from src.facts import GROUPINGS
+from src.projections import projection
+from src.store import VIEW_KEYS, store
+from src.table_query import tableValues
+
+logger = logging.getLogger(__name__)
+
+# This function builds everything the callbacks read from a snapshot, so none
+# of it has to be built (and copied) in a worker
+def preload():
+    start = time.perf_counter()
+    store.warm()
+    snapshot = store.snapshot
+    # Callbacks reading through the sqlite backend only build what they show
+    if store.backend.inMemory:
+        for key in VIEW_KEYS:
+            tableValues(snapshot, *key)
+            projection(snapshot, *key)
+        for grouping in GROUPINGS:
+            averagesCube(snapshot, grouping)
+            anomalyScan(snapshot, grouping)
+    # Move everything loaded so far out of the garbage collector's reach, so
+    # collections in the workers do not write to (and so copy) its pages.
+    # What an earlier preload froze is unfrozen first, so an old snapshot
+    # can still be collected after a reload
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
+    logger.info('Preloaded data version %d in %.2fs', snapshot.version, time.perf_counter() - start)
+
+app = create_app()
+server = app.server
+preload()